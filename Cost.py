@@ -1,46 +1,210 @@
- # -*- coding: utf-8 -*-
+# -*- coding: utf-8 -*-
 """
 Statistical Arbitrage Team Project
 
 @author: Fan Chen, Zhijiang Huang, Fei Li, Zhixian Lin
 
-Special Thanks to Junyi Zhou, Fan's Asset Management Teammate, to provide the 
+Special Thanks to Junyi Zhou, Fan's Asset Management Teammate, to provide the
 start-up code for the project
 """
 import numpy as np
 import pandas as pd
 
-class LinearCost:
+
+class CostModel:
+    """
+    Base class of the cost models. A cost model prices the absolute value traded, either one period at a time
+    (calculate_cost with the period number i) or a whole T x N trade matrix at once (calculate_cost_panel).
+    Models add up: LinearCost(0.001) + SqrtImpactCost(0.1, adv) charges both.
+    """
+    def align(self, index, columns):
+        """
+        Align the panels the model depends on to the price panel, called by the strategy before it runs.
+        :param index, columns: index and columns of the price panel
+        """
+        return self
+
+    def calculate_cost(self, reposition, i=None):
+        """
+        :param reposition: vector of absolute change in position value
+        :param i: period number, used by the models that depend on a panel
+        :return: vector of transaction cost
+        """
+        raise NotImplementedError
+
+    def calculate_cost_panel(self, reposition):
+        """
+        :param reposition: T x N array of absolute change in position value, aligned to the price panel
+        :return: T x N array of transaction cost
+        """
+        raise NotImplementedError
+
+    def __add__(self, other):
+        return CompositeCost(self, other)
+
+
+def _aligned(panel, index=None, columns=None):
+    """
+    :return: float64 array of a df panel reindexed to index and columns (arrays are taken as already aligned),
+    forward filled like the prices the strategy trades at. Cells before the first value stay NaN.
+    An axis sharing no label with the prices (a Month indexed panel against reset price rows) is taken in
+    order when the lengths match, any other mismatch raises rather than leaving the panel all NaN.
+    """
+    if isinstance(panel, pd.DataFrame) and index is not None:
+        panel = panel.set_axis(_labels(panel.index, index, "index"), axis=0)
+        panel = panel.set_axis(_labels(panel.columns, columns, "columns"), axis=1)
+        panel = panel.reindex(index=index, columns=columns)
+    return np.ascontiguousarray(pd.DataFrame(np.asarray(panel, dtype=np.float64)).ffill().to_numpy())
+
+
+def _labels(own, target, axis):
+    """
+    :return: labels of one panel axis to reindex on, target itself when the panel is positional along it
+    """
+    if target is None or own.isin(target).any():
+        return own
+    if len(own) == len(target):
+        return target
+    raise ValueError("cost panel %s share no label with the prices and have %d entries against %d"
+                     % (axis, len(own), len(target)))
+
+
+def _covered(cost, reposition, name):
+    """
+    :return: cost, after checking that every trade has one, a NaN cost would otherwise be dropped with the trade
+    """
+    missing = np.isnan(cost) & (np.nan_to_num(reposition) != 0)
+    if missing.any():
+        raise ValueError("%s has no data for %d traded cells, pass a panel covering the prices"
+                         % (name, missing.sum()))
+    return cost
+
+
+def _row(panel, i):
+    if i is None:
+        raise ValueError("this cost model depends on the period, pass i")
+    return panel[i]
+
+
+class CompositeCost(CostModel):
+    def __init__(self, *models):
+        """
+        :param models: cost models whose costs are added
+        """
+        self.models = []
+        for model in models:
+            self.models.extend(model.models if isinstance(model, CompositeCost) else [model])
+
+    def align(self, index, columns):
+        for model in self.models:
+            model.align(index, columns)
+        return self
+
+    def calculate_cost(self, reposition, i=None):
+        return sum(model.calculate_cost(reposition, i) for model in self.models)
+
+    def calculate_cost_panel(self, reposition):
+        return sum(model.calculate_cost_panel(reposition) for model in self.models)
+
+
+class LinearCost(CostModel):
     def __init__(self, cost):
         """
         :param cost: cost in abs (1% is 0.01)
         """
         self.cost = cost
 
-    def calculate_cost(self, reposition):
+    def calculate_cost(self, reposition, i=None):
         """
         :param reposition: vector of change in position value
-        :param mkt_cap: vector of market cap
         :return: vector of transaction cost
         """
         return reposition * self.cost
 
+    def calculate_cost_panel(self, reposition):
+        return reposition * self.cost
+
 
-class QuadraticCost:
+class QuadraticCost(CostModel):
     def __init__(self, linear, quadratic):
         self.linear = linear
         self.quadratic = quadratic
 
-    def calculate_cost(self, reposition):
+    def calculate_cost(self, reposition, i=None):
         return reposition * self.linear + np.power(reposition, 2) * self.quadratic
 
+    def calculate_cost_panel(self, reposition):
+        return reposition * self.linear + np.power(reposition, 2) * self.quadratic
+
+
+class SqrtImpactCost(CostModel):
+    def __init__(self, impact, total_value):
+        """
+        Square root market impact, cost = impact * reposition * sqrt(reposition / total_value)
+        :param impact: impact coefficient
+        :param total_value: df (or T x N array aligned to the prices) of value traded, e.g. ADV
+        """
+        self.impact = impact
+        self.total_value = total_value
+        self.value = _aligned(total_value)
+
+    def align(self, index, columns):
+        self.value = _aligned(self.total_value, index, columns)
+        return self
+
+    def calculate_cost(self, reposition, i=None):
+        return _covered(self.impact * reposition * np.sqrt(reposition / _row(self.value, i)), reposition,
+                        "SqrtImpactCost")
+
+    def calculate_cost_panel(self, reposition):
+        return _covered(self.impact * reposition * np.sqrt(reposition / self.value), reposition, "SqrtImpactCost")
 
-class ADVCost:
-    def __init__(self, total_value : pd.DataFrame, min_cost, max_cost):
+
+class SpreadCost(CostModel):
+    def __init__(self, bid, ask):
+        """
+        Half the relative bid ask spread on the value traded, for trades priced at the mid. The strategy already
+        buys at the ask and sells at the bid, so this is only an extra charge when comparing with mid prices.
+        :param bid, ask: df (or T x N arrays aligned to the prices) of bid and ask
+        """
+        self.bid = bid
+        self.ask = ask
+        self.align(None, None)
+
+    def align(self, index, columns):
+        bid, ask = _aligned(self.bid, index, columns), _aligned(self.ask, index, columns)
+        self.half_spread = (ask - bid) / (ask + bid)
+        return self
+
+    def calculate_cost(self, reposition, i=None):
+        return _covered(reposition * _row(self.half_spread, i), reposition, "SpreadCost")
+
+    def calculate_cost_panel(self, reposition):
+        return _covered(reposition * self.half_spread, reposition, "SpreadCost")
+
+
+class ADVCost(CostModel):
+    def __init__(self, total_value, min_cost, max_cost):
+        """
+        cost = reposition * (min_cost + (max_cost - min_cost) * sqrt(reposition / total_value))
+        :param total_value: df (or T x N array aligned to the prices) of value traded, e.g. ADV. Trades without
+        any value traded yet are charged max_cost.
+        """
         self.min_cost = min_cost
         self.max_cost = max_cost
         self.total_value = total_value
+        self.value = _aligned(total_value)
+
+    def align(self, index, columns):
+        self.value = _aligned(self.total_value, index, columns)
+        return self
+
+    def _rate(self, reposition, value):
+        rate = self.min_cost + (self.max_cost-self.min_cost) * np.sqrt(reposition / value)
+        return np.where(np.isnan(value), self.max_cost, rate)
 
-    def calculate_cost(self, reposition, i):
-        return reposition * (self.min_cost + (self.max_cost-self.min_cost) * np.sqrt(reposition / self.total_value.iloc[i]))
+    def calculate_cost(self, reposition, i=None):
+        return reposition * self._rate(reposition, _row(self.value, i))
 
+    def calculate_cost_panel(self, reposition):
+        return reposition * self._rate(reposition, self.value)
@@ -8,7 +8,130 @@ Special Thanks to Junyi Zhou, Fan's Asset Management Teammate, to provide the
 start-up code for the project
 """
 import numpy as np
-import scipy.stats.mstats as mstats
+import pandas as pd
+
+
+def _like(score, pos):
+    """return pos as a Series if score is one, like the element-wise arithmetic of the original filters"""
+    if isinstance(score, pd.Series):
+        return pd.Series(pos, index=score.index)
+    return pos
+
+
+def _group_keys(scores, groups):
+    """
+    :return: (key, size) where key numbers each (row, group) pair of the panel, -1 where the group is negative
+    """
+    T, N = scores.shape
+    if groups is None:
+        return np.repeat(np.arange(T), N).reshape(T, N), T
+    groups = np.asarray(groups, dtype=np.int64).reshape(T, N)
+    # at least 1, a panel where every group is negative still has a (NaN) key per row
+    width = max(groups.max() + 1, 1) if groups.size else 1
+    key = np.arange(T)[:, None] * width + groups
+    return np.where(groups >= 0, key, -1), T * width
+
+
+def _group_sum(values, key, size):
+    """sum of values over each key, ignoring NaN and negative keys"""
+    keep = key >= 0
+    return np.bincount(key[keep], weights=np.nan_to_num(values[keep]), minlength=size)
+
+
+def rank_panel(scores, groups=None):
+    """
+    Row-wise ranks of a T x N score panel, 1 for the lowest, ties get the average rank.
+    :param scores: T x N array of score, NaN are not ranked
+    :param groups: optional T x N integer array, ranks are then taken within each group of a row
+    :return: T x N array of ranks, NaN where score is NaN
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    T, N = scores.shape
+    if scores.size == 0:
+        return np.full((T, N), np.nan)
+    flat = scores.ravel()
+    rows = np.repeat(np.arange(T), N)
+    group = np.zeros(T * N, dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64).ravel()
+    # sort by row, then group, then score (NaN last)
+    order = np.lexsort((flat, group, rows))
+    s, g, r = flat[order], group[order], rows[order]
+    idx = np.arange(T * N)
+    new_group = np.r_[True, (r[1:] != r[:-1]) | (g[1:] != g[:-1])]
+    new_run = new_group | np.r_[True, s[1:] != s[:-1]]
+    position = idx - np.maximum.accumulate(np.where(new_group, idx, 0)) + 1
+    # a run of ties shares the average of its first and last position
+    first = position[new_run]
+    last = position[np.r_[new_run[1:], True]]
+    ranks = np.empty(T * N)
+    ranks[order] = ((first + last) / 2)[np.cumsum(new_run) - 1]
+    ranks[np.isnan(flat)] = np.nan
+    return ranks.reshape(T, N)
+
+
+def long_short_filter_panel(scores, long=90, short=10):
+    """
+    long_short_filter applied to every row of a T x N score panel.
+    :return: T x N array of position ratio
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    long_q = np.nanpercentile(scores, long, axis=1, keepdims=True)
+    short_q = np.nanpercentile(scores, short, axis=1, keepdims=True)
+    long_list = scores > long_q
+    short_list = scores < short_q
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (long_list / np.sum(long_list, axis=1, keepdims=True)
+                - short_list / np.sum(short_list, axis=1, keepdims=True))
+
+
+def ranking_filter_panel(scores, groups=None):
+    """
+    ranking_filter applied to every row (or every group of a row) of a T x N score panel.
+    :param groups: optional T x N integer array, negative groups get NaN
+    :return: T x N array of position ratio
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    key, size = _group_keys(scores, groups)
+    ranks = rank_panel(scores, groups)
+    n = _group_sum(~np.isnan(ranks), key, size)
+    rank_sum = _group_sum(ranks, key, size)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pos = np.nan_to_num(ranks - (rank_sum / n)[key])
+        pos /= (_group_sum(np.abs(pos), key, size) / 2)[key]
+    pos[key < 0] = np.nan
+    return pos
+
+
+def long_ranking_filter_panel(scores, groups=None):
+    """
+    long_ranking_filter applied to every row (or every group of a row) of a T x N score panel.
+    Rows (groups) without any score get NaN.
+    :param groups: optional T x N integer array, negative groups get NaN
+    :return: T x N array of position ratio
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    key, size = _group_keys(scores, groups)
+    ranks = rank_panel(scores, groups)
+    n = _group_sum(~np.isnan(ranks), key, size)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pos = np.nan_to_num(ranks / _group_sum(ranks, key, size)[key])
+    pos[(key < 0) | (n[key] == 0)] = np.nan
+    return pos
+
+
+def equal_weight_panel(scores, groups=None):
+    """
+    equal_weight applied to every row (or every group of a row) of a T x N score panel.
+    :param groups: optional T x N integer array, negative groups get NaN
+    :return: T x N array of position ratio
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    key, size = _group_keys(scores, groups)
+    valid = ~np.isnan(scores)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pos = valid / _group_sum(valid, key, size)[key]
+    pos[key < 0] = np.nan
+    return pos
+
 
 def long_short_filter(score, long=90, short=10):
     """
@@ -17,31 +140,29 @@ def long_short_filter(score, long=90, short=10):
     :param short: percent to short, 10 if short bottom 10%
     :return: vector of position ratio
     """
-    long_q = np.nanpercentile(score, long)
-    short_q = np.nanpercentile(score, short)
-    long_list = score > long_q
-    short_list = score < short_q
-    return long_list / np.sum(long_list) - short_list / np.sum(short_list)
+    return _like(score, long_short_filter_panel(np.asarray(score, dtype=np.float64)[None, :], long, short)[0])
 
 
 def ranking_filter(score):
     """lecture 4 slide 35"""
-    n = np.sum(~np.isnan(score))
-    ranks = mstats.rankdata(np.ma.masked_invalid(score))
-    ranks[ranks == 0] = np.nan
-    pos = np.nan_to_num(ranks - np.nansum(ranks) / n)
-    pos /= np.nansum(np.abs(pos)) / 2
-    return pos
+    return ranking_filter_panel(np.asarray(score, dtype=np.float64)[None, :])[0]
 
 def long_ranking_filter(score):
-    try:
-        ranks = mstats.rankdata(np.ma.masked_invalid(score))
-    except:
-        return score * 0 + 1 / len(score)
-    ranks[ranks == 0] = np.nan
-    pos = np.nan_to_num( ranks/ np.nansum(ranks))
-    return pos   
+    pos = long_ranking_filter_panel(np.asarray(score, dtype=np.float64)[None, :])[0]
+    if np.isnan(pos).all():
+        # no score to rank
+        return _like(score, pos)
+    return pos
     
 def equal_weight(score):
-    return (~np.isnan(score)) / np.sum(~np.isnan(score))
+    return _like(score, equal_weight_panel(np.asarray(score, dtype=np.float64)[None, :])[0])
+
 
+# panel version of each filter, and the ones that can also work within groups
+PANEL_FILTERS = {long_short_filter: long_short_filter_panel,
+                 ranking_filter: ranking_filter_panel,
+                 long_ranking_filter: long_ranking_filter_panel,
+                 equal_weight: equal_weight_panel}
+GROUPED_FILTERS = {ranking_filter: ranking_filter_panel,
+                   long_ranking_filter: long_ranking_filter_panel,
+                   equal_weight: equal_weight_panel}
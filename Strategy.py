@@ -8,11 +8,123 @@ Special Thanks to Junyi Zhou, Fan's Asset Management Teammate, to provide the
 start-up code for the project
 """
 
+import time
+
 import numpy as np
 import pandas as pd
 
+from Filter import GROUPED_FILTERS
+from analytics import strategyMetrics
+
+STAGES = ["ffill", "filter", "sizing", "cost", "valuation"]
+
+def industry_codes(industry, ind_list):
+    """
+    Encode industry labels as integers: the position in ind_list, len(ind_list) and up for other labels,
+    -1 for missing.
+    :param industry: array or df of industry labels
+    :return: integer array of the same shape
+    """
+    labels, uniques = pd.factorize(np.asarray(industry, dtype=object).ravel())
+    position = {ind: k for k, ind in enumerate(ind_list)}
+    lookup = np.empty(len(uniques) + 1, dtype=np.int64)
+    lookup[-1] = -1
+    extra = len(position)
+    for k, ind in enumerate(uniques):
+        if ind in position:
+            lookup[k] = position[ind]
+        else:
+            lookup[k] = extra
+            extra += 1
+    return lookup[labels].reshape(np.shape(industry))
+
+
+class Instrumentation:
+    """
+    Stage timers and counters of a backtest. Timers are only read when timers is True, so the default costs a
+    dictionary update per stage. The hook, when given, is called at the end of every period with the period number
+    and a dict of that period's stage times and counters.
+    """
+    def __init__(self, timers=False, hook=None):
+        self.timers = timers
+        self.hook = hook
+        self.timings = dict.fromkeys(STAGES, 0.)
+        self.counters = {"periods": 0, "rebalances": 0, "trades": 0, "names_held": 0, "cost_paid": 0.,
+                         "turnover": 0.}
+        self.period = {}
+
+    def start(self):
+        return time.perf_counter() if self.timers else 0.
+
+    def stop(self, stage, start):
+        if self.timers:
+            elapsed = time.perf_counter() - start
+            self.timings[stage] += elapsed
+            self.period[stage] = self.period.get(stage, 0.) + elapsed
+
+    def end_period(self, i, rebalanced, trades, names_held, cost_paid, turnover):
+        self.counters["periods"] += 1
+        self.counters["rebalances"] += int(rebalanced)
+        self.counters["trades"] += int(trades)
+        self.counters["names_held"] = int(names_held)
+        self.counters["cost_paid"] += float(cost_paid)
+        self.counters["turnover"] += float(turnover)
+        if self.hook is not None:
+            self.period.update(rebalanced=bool(rebalanced), trades=int(trades), names_held=int(names_held),
+                               cost_paid=float(cost_paid), turnover=float(turnover))
+            self.hook(i, self.period)
+        self.period = {}
+
+    def summary(self):
+        """
+        :return: dict with the counters (names_held is the number of names held at the end) and, when timers is
+                 True, the seconds spent in each stage summed over the periods
+        """
+        summary = dict(self.counters)
+        if self.timers:
+            summary.update({stage + "_seconds": seconds for stage, seconds in self.timings.items()})
+        return summary
+
+
+class StrategyState:
+    """
+    The book of a strategy between two periods: everything step() needs to advance it by one period.
+    """
+    def __init__(self, columns, forming, holding):
+        nStock = len(columns)
+        self.columns = pd.Index(columns)
+        self.period = 0                                  # number of the next period
+        self.cash = 0.
+        self.value = 0.
+        self.tranches = np.zeros((holding, nStock))      # ring buffer, slot i % holding holds the tranche opened at i
+        self.total_shares = np.zeros(nStock)             # running sum of the open tranches
+        self.last_price = np.full(nStock, np.nan)        # last traded price, bid and ask
+        self.last_bid = np.full(nStock, np.nan)
+        self.last_ask = np.full(nStock, np.nan)
+        self.price_history = np.full((max(forming, 1), nStock), np.nan)   # slot i % forming holds the price of i
+
+    def save(self, path):
+        np.savez(path, columns=np.asarray(self.columns, dtype=object), period=self.period, cash=self.cash,
+                 value=self.value, tranches=self.tranches, total_shares=self.total_shares,
+                 last_price=self.last_price, last_bid=self.last_bid, last_ask=self.last_ask,
+                 price_history=self.price_history)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=True) as f:
+            state = cls.__new__(cls)
+            state.columns = pd.Index(f["columns"])
+            state.period = int(f["period"])
+            state.cash = f["cash"][()]
+            state.value = f["value"][()]
+            for name in ["tranches", "total_shares", "last_price", "last_bid", "last_ask", "price_history"]:
+                setattr(state, name, f[name].copy())
+        return state
+
+
 class SectorRotationStrategy:
-    def __init__(self, price, bid, ask, score, industry, forming, holding, ind_fltr, stock_fltr, cost_model, ind_list, capital=1000, second_score = None):
+    def __init__(self, price, bid, ask, score, industry, forming, holding, ind_fltr, stock_fltr, cost_model, ind_list, capital=1000, second_score = None, momentum = None, industry_codes = None,
+                 verbose=0, timers=False, hook=None):
         """
         :param price: df of prices
         :param b2m: df of book to market
@@ -24,6 +136,11 @@ class SectorRotationStrategy:
         :param filtr: a function that takes vector of score and returns vector of position weight
         :param cost_model: cost model
         :param capital: capital for long-short (eg. capital=1000 means if you sum all portfolios, long 1000 and short 1000)
+        :param momentum: precomputed price.pct_change(forming), e.g. shared across a parameter sweep
+        :param industry_codes: precomputed industry_codes(industry, ind_list)
+        :param verbose: 0 is silent, 1 prints the period and the weight sum, 2 also prints the industry weights
+        :param timers: time the stages of each period (see STAGES), summed over the run
+        :param hook: function(i, stats) called at the end of every period, e.g. for a profiler or metrics exporter
         """
         self.price = price
         self.bid = bid
@@ -37,30 +154,296 @@ class SectorRotationStrategy:
         self.stock_fltr = stock_fltr
         self.cost_model = cost_model
         self.ind_list   = ind_list
-        self.momentum = self.price.pct_change(forming)       # lagged rolling return
-        self.second_score = second_score if second_score else self.momentum 
+        self.momentum = momentum if momentum is not None else self.price.pct_change(forming)       # lagged rolling return
+        self.second_score = second_score if second_score is not None else self.momentum
+        self.second_is_momentum = second_score is None
+        self.industry_codes = None if industry_codes is None else np.asarray(industry_codes)
+        self.verbose = verbose
+        self.timers = timers
+        self.hook = hook
+        self.instruments = Instrumentation(timers, hook)
         
-    def filtr(self, score, second_score, ind):
-        res = score * np.nan
-        indDf = pd.DataFrame({'Ind': ind, "score": score}).drop_duplicates(subset = "Ind")
-        indDf["Weight"] = self.ind_fltr(indDf.score)
-        print("Industry Weight", np.nansum(indDf.Weight))
-        for indsty in self.ind_list:
-            if len(indDf.Weight[indDf.Ind == indsty].values) > 0:
-                res[ind == indsty]  = self.stock_fltr(second_score[ind == indsty]) * indDf.Weight[indDf.Ind == indsty].values[0]
-            else: 
-                res[ind == indsty]  = self.stock_fltr(second_score[ind == indsty]) * 0
-            print("Industry", indsty,"Stock Weight Sum", np.nansum(res[ind == indsty]))
-        return res
-    
-    def run(self):
+    def filtr(self, score, second_score, ind, codes=None):
+        """
+        Allocate the industry weights (ind_fltr on the first score seen in each industry) to the stocks of each
+        industry in ind_list (stock_fltr on second_score within the industry).
+        :param ind: vector of industry labels, only used when codes is not given
+        :param codes: vector of industry codes from industry_codes, skips encoding the labels every period
+        :return: vector of position weight, NaN for stocks outside ind_list
+        """
+        if codes is None:
+            codes = industry_codes(np.asarray(ind, dtype=object), self.ind_list)
+        # sort once by industry, each industry is then a contiguous segment of `order`
+        group = np.asarray(codes) + 1                        # group 0 are the stocks without industry
+        order = np.argsort(group, kind="stable")
+        sorted_group = group[order]
+        starts = np.flatnonzero(np.r_[True, sorted_group[1:] != sorted_group[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        present = sorted_group[starts]
+        # one score per industry in order of first appearance, like drop_duplicates on the industry
+        first = order[starts]
+        appearance = np.argsort(first, kind="stable")
+        ind_weight = np.zeros(present[-1] + 1 if len(present) else 1)
+        ind_weight[present[appearance]] = self.ind_fltr(np.asarray(score, dtype=np.float64)[first[appearance]])
+        if self.verbose >= 2:
+            print("Industry Weight", np.nansum(ind_weight))
+
+        second_score = np.asarray(second_score, dtype=np.float64)
+        nList = len(self.ind_list)
+        grouped = GROUPED_FILTERS.get(self.stock_fltr)
+        if grouped is not None:
+            # the whole allocation in one call that works within each industry
+            in_list = (group >= 1) & (group <= nList)
+            stock_weight = grouped(second_score[None, :], np.where(in_list, group, -1)[None, :])[0]
+        else:
+            stock_weight = np.full(len(order), np.nan)
+            sorted_score = second_score[order]
+            for start, end, g in zip(starts, ends, present):
+                if 1 <= g <= nList:
+                    stock_weight[order[start:end]] = self.stock_fltr(sorted_score[start:end])
+        # broadcast the industry weight to the stocks by a gather
+        weight = stock_weight * ind_weight[group]
+
+        if self.verbose >= 2:
+            weight_sum = np.bincount(group, weights=np.nan_to_num(weight), minlength=nList + 1)
+            for k, indsty in enumerate(self.ind_list):
+                print("Industry", indsty, "Stock Weight Sum", weight_sum[k + 1])
+        if isinstance(score, pd.Series):
+            return pd.Series(weight, index=score.index)
+        return weight
+
+    def codes(self):
+        """
+        :return: T x N array of industry codes (see industry_codes), computed once unless given to the constructor
+        """
+        if self.industry_codes is None:
+            self.industry_codes = industry_codes(self.industry, self.ind_list)
+        return self.industry_codes
+
+    def last_traded(self):
+        """
+        :return: price, bid and ask forward filled with the last traded value (NaN before the first trade)
+        """
+        return self.price.ffill(), self.bid.ffill(), self.ask.ffill()
+
+    def run(self, engine="array"):
+        """
+        Backtest the strategy, filling self.cash, self.shares, self.weights, self.value and self.reposition (the
+        value traded, positive for buys). The counters and stage timers of the run are then available from
+        summary(), and the array engine leaves the book in self.state, ready for step().
+        :param engine: "array" converts the panels to numpy once and keeps the open tranches in a ring buffer,
+                       "pandas" is the original row-by-row loop, kept as a reference implementation
+        """
+        self.instruments = Instrumentation(self.timers, self.hook)
+        if engine == "array":
+            self._run_array()
+        elif engine == "pandas":
+            self._run_pandas()
+        else:
+            raise ValueError("unknown engine: %s" % engine)
+
+    def summary(self):
+        """
+        :return: dict of the counters and stage timers of the last run, see Instrumentation.summary
+        """
+        return self.instruments.summary()
+
+    def calculate_metrics(self, periods=12):
+        """
+        :return: annualized return, volatility and Sharpe ratio of the last run, see analytics for the others
+        """
+        metrics = strategyMetrics(self, periods)
+        return metrics["annual_return"], metrics["volatility"], metrics["sharpe"]
+
+    def reprice(self, cost_model):
+        """
+        The trades do not depend on the cost model (positions are sized on capital, not on cash), so a run can be
+        priced under another cost model from self.reposition without running it again.
+        :param cost_model: cost model, evaluated on the whole trade matrix at once
+        :return: (value, cost_paid) series under cost_model
+        """
+        reposition = self.reposition.to_numpy()
+        cost = cost_model.align(self.price.index, self.price.columns).calculate_cost_panel(np.abs(reposition))
+        old_cost = self.cost_model.calculate_cost_panel(np.abs(reposition))
+        # cash is charged the notional and the cost separately, as in run
+        paid = np.nansum(cost, axis=1) - np.nansum(old_cost, axis=1)
+        value = self.value.to_numpy() - np.cumsum(paid)
+        return (pd.Series(data=value, index=self.value.index),
+                pd.Series(data=np.nansum(cost, axis=1), index=self.value.index))
+
+    def _advance(self, state, i, bid, ask, score, second_score, codes, rebalance):
+        """
+        Advance the book by period i, the kernel shared by run() and step().
+        :param bid, ask: vectors of last traded bid and ask
+        :param rebalance: open a new tranche this period
+        :return: (values_to_open, shares_to_open, reposition_shares, reposition, transaction_cost)
+        """
+        instruments = self.instruments
+        if self.verbose:
+            print(i)
+        slot = i % self.holding
+        # close the tranche opened holding periods ago
+        shares_to_close = state.tranches[slot]
+        # open new position
+        if rebalance:
+            start = instruments.start()
+            pos = self.filtr(score, second_score, None, codes)
+            instruments.stop("filter", start)
+            if self.verbose:
+                print(np.nansum(pos))
+            start = instruments.start()
+            values_to_open = np.nan_to_num(pos * self.capital / self.holding)
+            shares_to_open = np.nan_to_num(values_to_open * (values_to_open > 0) / ask
+                                           + values_to_open * (values_to_open < 0) / bid)
+        else:
+            start = instruments.start()
+            values_to_open = np.zeros(len(state.total_shares))
+            shares_to_open = values_to_open
+
+        reposition_shares = shares_to_open - shares_to_close
+        reposition = np.nan_to_num(reposition_shares * (reposition_shares > 0) * ask
+                                   + reposition_shares * (reposition_shares < 0) * bid)
+        instruments.stop("sizing", start)
+        start = instruments.start()
+        transaction_cost = self.cost_model.calculate_cost(np.abs(reposition), i)
+        instruments.stop("cost", start)
+        start = instruments.start()
+        state.cash = state.cash - np.nansum(reposition) - np.nansum(transaction_cost)
+        state.total_shares += shares_to_open - shares_to_close
+        state.tranches[slot] = shares_to_open
+        # this is the value of portfolio if we close out everything now
+        state.value = np.nansum(state.total_shares * (state.total_shares > 0) * bid
+                                + state.total_shares * (state.total_shares < 0) * ask) + state.cash
+        instruments.stop("valuation", start)
+        instruments.end_period(i, rebalance, np.count_nonzero(reposition), np.count_nonzero(state.total_shares),
+                               np.nansum(transaction_cost), np.sum(np.abs(reposition)))
+        return values_to_open, shares_to_open, reposition_shares, reposition, transaction_cost
+
+    def _run_array(self):
+        instruments = self.instruments
+        index, columns = list(self.price.index), list(self.price)
+        start = instruments.start()
+        price, bid, ask = (np.ascontiguousarray(df.to_numpy(dtype=np.float64)) for df in self.last_traded())
+        instruments.stop("ffill", start)
+        score = np.ascontiguousarray(self.score.to_numpy(dtype=np.float64))
+        second_score = np.ascontiguousarray(self.second_score.to_numpy(dtype=np.float64))
+        codes = self.codes()
+        has_momentum = (~np.isnan(self.momentum.to_numpy(dtype=np.float64))).any(axis=1)
+        self.cost_model.align(self.price.index, self.price.columns)
+        nPeriod, nStock = price.shape
+
+        cash = np.zeros(nPeriod)
+        value = np.zeros(nPeriod)
+        turnover = np.zeros(nPeriod)
+        cost_paid = np.zeros(nPeriod)
+        shares = np.zeros((nPeriod, nStock))
+        weights = np.zeros((nPeriod, nStock))
+        repositions = np.zeros((nPeriod, nStock))
+        state = StrategyState(columns, self.forming, self.holding)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for i in range(self.forming, nPeriod):
+                # stop building new position when holding period < time left
+                rebalance = i <= nPeriod - self.holding and has_momentum[i]
+                weights[i], shares[i], _, repositions[i], transaction_cost = self._advance(
+                    state, i, bid[i], ask[i], score[i], second_score[i], codes[i], rebalance)
+                cash[i] = state.cash
+                value[i] = state.value
+                turnover[i] = np.sum(np.abs(repositions[i]))
+                cost_paid[i] = np.nansum(transaction_cost)
+
+        self.cash = pd.Series(data=cash, index=index)
+        self.shares = pd.DataFrame(data=shares, columns=columns, index=index)
+        self.weights = pd.DataFrame(data=weights, columns=columns, index=index)
+        self.value = pd.Series(data=value, index=index)
+        self.turnover = pd.Series(data=turnover, index=index)
+        self.cost_paid = pd.Series(data=cost_paid, index=index)
+        self.reposition = pd.DataFrame(data=repositions, columns=columns, index=index)
+
+        # the book after the last period, for step()
+        state.period = nPeriod
+        if nPeriod:
+            state.last_price, state.last_bid, state.last_ask = price[-1].copy(), bid[-1].copy(), ask[-1].copy()
+        raw = self.price.to_numpy(dtype=np.float64)
+        for j in range(max(nPeriod - self.forming, 0), nPeriod):
+            state.price_history[j % len(state.price_history)] = raw[j]
+        self.state = state
+
+    def init_state(self, columns=None):
+        """
+        An empty book, to step() through history from the first period.
+        :param columns: the tickers, those of the price panel by default
+        """
+        self.state = StrategyState(self.price.columns if columns is None else columns, self.forming, self.holding)
+        if not hasattr(self, "instruments"):
+            self.instruments = Instrumentation(self.timers, self.hook)
+        return self.state
+
+    def step(self, price, bid, ask, score, industry, second_score=None, can_open=True):
+        """
+        Advance the book in self.state (from run() or init_state()) by one period, in time independent of the
+        length of the history. Stepping month by month through the panels reproduces run() exactly, provided
+        can_open is False for the last holding - 1 periods, where run() stops building new positions (so a book left
+        by run() did not open tranches in its last holding - 1 periods).
+        Cost models that depend on a panel are evaluated at the period number, their panel must cover it.
+        :param price, bid, ask, score, industry: the new month, vectors (or series) ordered like state.columns
+        :param second_score: the second score of the month, required when the strategy was given one
+        :param can_open: open a new tranche this period (when the momentum is available)
+        :return: df of the orders to send, shares (positive to buy), value traded and cost, by ticker
+        """
+        state = self.state
+        i = state.period
+        price, bid, ask, score = (np.asarray(x, dtype=np.float64) for x in (price, bid, ask, score))
+        # last traded value, as in last_traded()
+        state.last_price = np.where(np.isnan(price), state.last_price, price)
+        state.last_bid = np.where(np.isnan(bid), state.last_bid, bid)
+        state.last_ask = np.where(np.isnan(ask), state.last_ask, ask)
+        # momentum over forming periods, as price.pct_change(forming)
+        slot = i % len(state.price_history)
+        base = price if self.forming == 0 else state.price_history[slot]
+        momentum = price / base - 1 if i >= self.forming else np.full(len(price), np.nan)
+        state.price_history[slot] = price
+        if self.second_is_momentum:
+            second_score = momentum
+        elif second_score is None:
+            raise ValueError("the strategy has a second score, pass second_score")
+        orders = np.zeros((len(price), 3))
+        if i >= self.forming:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rebalance = can_open and (~np.isnan(momentum)).any()
+                codes = industry_codes(np.asarray(industry, dtype=object), self.ind_list)
+                orders[:, 0], orders[:, 1], orders[:, 2] = self._advance(
+                    state, i, state.last_bid, state.last_ask, score, np.asarray(second_score, dtype=np.float64),
+                    codes, rebalance)[2:]
+        state.period = i + 1
+        orders = pd.DataFrame(orders, index=state.columns, columns=["shares", "value", "cost"])
+        return orders[orders.value != 0]
+
+    def append(self, price, bid, ask, score, industry, second_score=None, can_open=True):
+        """
+        step() through several new months.
+        :param price, bid, ask, score, industry, second_score: df of the new months, columns like state.columns
+        :return: df of the orders of every month, indexed by (month, ticker)
+        """
+        orders = {}
+        for k, month in enumerate(price.index):
+            orders[month] = self.step(price.iloc[k], bid.iloc[k], ask.iloc[k], score.iloc[k], industry.iloc[k],
+                                      None if second_score is None else second_score.iloc[k], can_open)
+        return pd.concat(orders, names=["month", "ticker"]) if orders else pd.DataFrame(columns=["shares", "value", "cost"])
+
+    def _run_pandas(self):
         self.cash = pd.Series(data=0., index=list(self.price.index))    # assume all strategy have zero value to set up
         self.shares = pd.DataFrame(data=0., columns=list(self.price), index=list(self.price.index))
         self.weights = pd.DataFrame(data=0., columns=list(self.price), index=list(self.price.index))
         self.value = pd.Series(data=0., index=list(self.price.index))            # value of all current portfolios
-        bid = np.zeros(self.price.shape[1])
-        ask = np.zeros(self.price.shape[1])
-        price = np.zeros(self.price.shape[1])
+        self.turnover = pd.Series(data=0., index=list(self.price.index))         # value traded each period
+        self.cost_paid = pd.Series(data=0., index=list(self.price.index))        # transaction cost paid each period
+        self.reposition = pd.DataFrame(data=0., columns=list(self.price), index=list(self.price.index))
+        cost_model = self.cost_model.align(self.price.index, self.price.columns)
+        instruments = self.instruments
+        start = instruments.start()
+        last_price, last_bid, last_ask = self.last_traded()
+        instruments.stop("ffill", start)
         nPeriod = self.price.shape[0]
         
         for i in range(self.forming, nPeriod):
@@ -97,23 +480,30 @@ class SectorRotationStrategy:
 #            self.value.iloc[i] = self.cash.iloc[i] + sum((total_shares*cur_price).replace(np.nan, 0))
             
             # print(self.momentum.index[i])
-            bid = bid * (np.isnan(self.bid.iloc[i])) + self.bid.iloc[i] * (~np.isnan(self.bid.iloc[i]))
-            ask = ask * (np.isnan(self.ask.iloc[i])) + self.ask.iloc[i] * (~np.isnan(self.ask.iloc[i]))
-            price = price * (np.isnan(self.price.iloc[i])) + self.price.iloc[i] * (~np.isnan(self.price.iloc[i]))
-            print(i)
+            bid = last_bid.iloc[i]
+            ask = last_ask.iloc[i]
+            price = last_price.iloc[i]
+            if self.verbose:
+                print(i)
             # close old position
             if i >= self.forming + self.holding - 1:
                 shares_to_close = np.nan_to_num(self.shares.iloc[i - self.holding])
             else:
                 shares_to_close = 0
             # open new position, stop building new position when holding period < time left
-            if i <= self.price.shape[0] - self.holding and (~np.isnan(self.momentum.iloc[i])).any():
+            rebalance = i <= self.price.shape[0] - self.holding and (~np.isnan(self.momentum.iloc[i])).any()
+            if rebalance:
+                start = instruments.start()
                 weights = self.filtr(self.score.iloc[i], self.second_score.iloc[i], self.industry.iloc[i])
-                print(np.nansum(weights))
+                instruments.stop("filter", start)
+                if self.verbose:
+                    print(np.nansum(weights))
+                start = instruments.start()
                 values_to_open = np.nan_to_num( weights * self.capital / self.holding)
                 shares_to_open = np.nan_to_num(values_to_open * (values_to_open>0) / ask
                                                + values_to_open * (values_to_open<0) / bid)
             else:
+                start = instruments.start()
                 shares_to_open = 0
                 values_to_open = 0
             
@@ -121,15 +511,25 @@ class SectorRotationStrategy:
             reposition_shares = shares_to_open - shares_to_close
             reposition = np.nan_to_num(reposition_shares * (reposition_shares>0) * ask
                                        + reposition_shares * (reposition_shares<0) * bid)
-            transaction_cost = self.cost_model.calculate_cost(np.abs(reposition))
+            instruments.stop("sizing", start)
+            start = instruments.start()
+            transaction_cost = cost_model.calculate_cost(np.abs(reposition), i)
+            instruments.stop("cost", start)
+            start = instruments.start()
             # current cash = previous cash + proceed from closing - cost to open - transaction
-            self.cash[i] = self.cash[i-1] - np.nansum(reposition + transaction_cost)
+            self.cash.iloc[i] = self.cash.iloc[i-1] - np.nansum(reposition) - np.nansum(transaction_cost)
+            self.turnover.iloc[i] = np.sum(np.abs(reposition))
+            self.cost_paid.iloc[i] = np.nansum(transaction_cost)
+            self.reposition.iloc[i] = reposition
             self.shares.iloc[i] = shares_to_open
             self.weights.iloc[i] = values_to_open
-            total_shares = self.shares.iloc[i-self.holding+1:i+1].sum(axis=0)
+            total_shares = self.shares.iloc[max(i-self.holding+1, 0):i+1].sum(axis=0)
             # this is the value of portfolio if we close out everything now
             self.value.iloc[i] = np.sum(total_shares*(total_shares>0)*bid
-                                        + total_shares*(total_shares<0)*ask) + self.cash[i]
+                                        + total_shares*(total_shares<0)*ask) + self.cash.iloc[i]
+            instruments.stop("valuation", start)
+            instruments.end_period(i, rebalance, np.count_nonzero(reposition), np.count_nonzero(total_shares),
+                                   self.cost_paid.iloc[i], self.turnover.iloc[i])
 
 #    def run_without_bid_ask(self):
 #        self.cash = pd.Series(data=0., index=list(self.price.index))  # assume all strategy have zero value to set up
@@ -166,10 +566,6 @@ class SectorRotationStrategy:
 #            self.weights.iloc[i] = shares_to_open * trading_price / self.capital * self.holding
 #            self.value.iloc[i] = np.sum(self.shares.iloc[i - self.holding+1:i + 1].sum(axis=0) * trading_price) + self.cash[i]
 #
-#    def calculate_metrics(self):
-#        annual_return = self.value[-1] / self.capital / (self.price.shape[0] - self.forming) * 12
-#        volatility = np.nanstd(self.value.diff() / self.capital) * np.sqrt(12/(self.price.shape[0] - self.forming))
-#        return annual_return, volatility, annual_return / volatility
 #    
 #class SectorRotationStrategy(Strategy):
 #    def __init__(self, price : pd.DataFrame, forming, holding, filtr, cost_model, capital=1000, smooth=0):
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Statistical Arbitrage Team Project
+
+@author: Fan Chen, Zhijiang Huang, Fei Li, Zhixian Lin
+
+Parameter sweeps of SectorRotationStrategy over forming / holding / cost /
+filter grids. The inputs every combination shares (last traded prices,
+momentum for each distinct forming period, industry codes) are prepared
+once and handed to each worker process once, not once per combination.
+Combinations that only differ by cost share one backtest, the other costs
+are priced on its trade matrix.
+"""
+
+import os
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from Strategy import SectorRotationStrategy, industry_codes
+from Cost import LinearCost
+from analytics import performanceMetrics
+
+PARAMS = ["forming", "holding", "cost", "ind_fltr", "stock_fltr"]
+
+_shared = None      # inputs shared by every combination, set once per worker
+
+
+def prepareInputs(price, bid, ask, score, industry, ind_list, formings, capital = 1000):
+    """
+    Precompute the inputs shared by every combination of a sweep.
+    :param formings: the forming periods of the grid, momentum is computed once for each distinct value
+    :return: dict of shared inputs
+    """
+    price = price.astype(np.float64)
+    return {"price": price.ffill(),
+            "bid": bid.astype(np.float64).ffill(),
+            "ask": ask.astype(np.float64).ffill(),
+            "score": score.astype(np.float64),
+            "industry": industry,
+            "industry_codes": industry_codes(industry, ind_list),
+            "ind_list": ind_list,
+            "capital": capital,
+            "momentum": {f: price.pct_change(f) for f in sorted(set(formings))}}
+
+
+def expandGrid(grid):
+    """
+    :param grid: dict with lists for "forming", "holding", "cost" and "filters", a list of (ind_fltr, stock_fltr) pairs
+    :return: list of parameter dicts, one per combination
+    """
+    combos = []
+    for forming, holding, cost, (ind_fltr, stock_fltr) in itertools.product(
+            grid["forming"], grid["holding"], grid["cost"], grid["filters"]):
+        combos.append({"forming": forming, "holding": holding, "cost": cost,
+                       "ind_fltr": ind_fltr, "stock_fltr": stock_fltr})
+    return combos
+
+
+def combinationKey(params):
+    """
+    :return: string that identifies a combination, filters are identified by name
+    """
+    return "|".join("%s=%s" % (name, getattr(params[name], "__name__", params[name])) for name in PARAMS)
+
+
+def _initWorker(shared):
+    global _shared
+    _shared = shared
+
+
+def _result(params, strat, value, cost_paid):
+    row = {name: getattr(params[name], "__name__", params[name]) for name in PARAMS}
+    row["key"] = combinationKey(params)
+    row["final_value"] = value.iloc[-1]
+    row["turnover"] = strat.turnover.sum()
+    row["cost_paid"] = cost_paid.sum()
+    # the metrics of strategyMetrics / the pipeline, on the value under this combination's cost
+    row["sharpe"] = performanceMetrics(value, strat.capital, strat.forming)["sharpe"]
+    return row, value.to_numpy()
+
+
+def _runGroup(group):
+    """
+    Run the combinations of a group, which only differ by cost. The trades do not depend on the cost, so the
+    strategy runs once and every other cost is priced on its trade matrix (see SectorRotationStrategy.reprice).
+    :return: list of (row, value) pairs, one per combination
+    """
+    first = group[0]
+    strat = SectorRotationStrategy(_shared["price"], _shared["bid"], _shared["ask"], _shared["score"],
+                                   _shared["industry"], first["forming"], first["holding"],
+                                   first["ind_fltr"], first["stock_fltr"], LinearCost(first["cost"]),
+                                   _shared["ind_list"], capital = _shared["capital"],
+                                   momentum = _shared["momentum"][first["forming"]],
+                                   industry_codes = _shared["industry_codes"])
+    strat.run()
+    results = [_result(first, strat, strat.value, strat.cost_paid)]
+    for params in group[1:]:
+        results.append(_result(params, strat, *strat.reprice(LinearCost(params["cost"]))))
+    return results
+
+
+def groupByTrades(combos):
+    """
+    :return: list of groups of combinations that only differ by cost
+    """
+    groups = {}
+    for params in combos:
+        groups.setdefault(tuple(params[name] for name in PARAMS if name != "cost"), []).append(params)
+    return list(groups.values())
+
+
+def sweep(price, bid, ask, score, industry, ind_list, grid, capital = 1000, workers = None, out = None, curves = False):
+    """
+    Run SectorRotationStrategy on every combination of a parameter grid.
+
+    :param price, bid, ask, score, industry, ind_list: as in SectorRotationStrategy
+    :param grid: see expandGrid
+    :param workers: number of processes, None uses every core, 1 runs in this process
+    :param out: optional csv path; finished combinations are appended as they complete, and combinations already in
+                the file are skipped, so an interrupted sweep resumes where it stopped
+    :param curves: also return the equity curves (value series) of the combinations run
+    :return: DataFrame with one row per combination (final value, turnover, cost paid, Sharpe),
+             and a DataFrame of equity curves keyed by combination when curves is True
+    """
+    global _shared
+    combos = expandGrid(grid)
+    done = pd.read_csv(out) if out is not None and os.path.exists(out) else None
+    if done is not None:
+        finished = set(done["key"])
+        combos = [params for params in combos if combinationKey(params) not in finished]
+
+    rows, equity = [], {}
+    if combos:
+        shared = prepareInputs(price, bid, ask, score, industry, ind_list,
+                               [params["forming"] for params in combos], capital)
+
+        def collect(row, value):
+            rows.append(row)
+            if curves:
+                equity[row["key"]] = value
+            if out is not None:
+                pd.DataFrame([row]).to_csv(out, mode = "a", index = False, header = not os.path.exists(out))
+
+        groups = groupByTrades(combos)
+        workers = workers or os.cpu_count() or 1
+        if workers == 1:
+            _shared = shared
+            try:
+                for group in groups:
+                    for row, value in _runGroup(group):
+                        collect(row, value)
+            finally:
+                _shared = None
+        else:
+            with ProcessPoolExecutor(max_workers = workers, initializer = _initWorker, initargs = (shared,)) as pool:
+                for results in pool.map(_runGroup, groups):
+                    for row, value in results:
+                        collect(row, value)
+
+    results = pd.DataFrame(rows)
+    if done is not None:
+        results = pd.concat([done, results], ignore_index = True)
+    results = results.reset_index(drop = True)
+    if curves:
+        return results, pd.DataFrame(equity, index = price.index)
+    return results
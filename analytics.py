@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Statistical Arbitrage Team Project
+
+@author: Fan Chen, Zhijiang Huang, Fei Li, Zhixian Lin
+
+Performance analytics of a SectorRotationStrategy run, computed on the arrays
+of its outputs (value, shares, turnover, cost paid) in one pass. Rolling
+metrics use cumulative sums, so a rolling window costs the same as a full
+sample metric whatever the window length.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def periodReturns(value, capital, start = 0):
+    """
+    P&L over capital of each period from start on, value being the strategy
+    value (P&L in dollars, 0 before the first trade)
+    """
+    value = np.asarray(value, dtype = np.float64)
+    return np.diff(value[max(start - 1, 0):]) / capital
+
+
+def drawdown(value, capital):
+    """
+    Drawdown of each period in units of capital, and the longest number of
+    consecutive periods spent below a previous peak.
+
+    Output: (drawdown array, max drawdown, max duration)
+    """
+    value = np.asarray(value, dtype = np.float64)
+    peak = np.maximum.accumulate(value)
+    dd = (value - peak) / capital
+    under = dd < 0
+    # length of the current run below the peak, reset at every new peak
+    position = np.arange(len(value))
+    lastPeak = np.maximum.accumulate(np.where(under, -1, position))
+    duration = np.where(under, position - lastPeak, 0)
+    return dd, (dd.min() if len(dd) else 0.), (int(duration.max()) if len(duration) else 0)
+
+
+def performanceMetrics(value, capital, start = 0, turnover = None, cost_paid = None, periods = 12):
+    """
+    Input:
+        - value: strategy value, Series or array
+        - capital: the capital of the strategy
+        - start: (Default: 0) first period of the backtest, the forming period
+        - turnover, cost_paid: (Default: None) value traded and cost paid of
+        each period, from the strategy
+        - periods: (Default: 12) periods per year
+
+    Output: Series with the annualized return, volatility and Sharpe ratio,
+    the max drawdown (in units of capital) and its duration (periods), and
+    when given the annual turnover and cost drag (both over capital)
+    """
+    returns = periodReturns(value, capital, start)
+    n = len(returns)
+    mean = returns.mean() if n else np.nan
+    std = returns.std(ddof = 1) if n > 1 else np.nan
+    _, maxDrawdown, duration = drawdown(np.asarray(value, dtype = np.float64)[max(start - 1, 0):], capital)
+    metrics = {"annual_return": mean * periods,
+               "volatility": std * np.sqrt(periods),
+               "sharpe": mean / std * np.sqrt(periods) if std > 0 else np.nan,
+               "max_drawdown": maxDrawdown,
+               "drawdown_duration": duration}
+    years = n / periods if n else np.nan
+    if turnover is not None:
+        metrics["turnover"] = np.nansum(np.asarray(turnover, dtype = np.float64)[start:]) / capital / years
+    if cost_paid is not None:
+        metrics["cost_drag"] = np.nansum(np.asarray(cost_paid, dtype = np.float64)[start:]) / capital / years
+    return pd.Series(metrics)
+
+
+def rollingMetrics(value, capital, window = 36, start = 0, turnover = None, cost_paid = None, periods = 12):
+    """
+    Rolling annualized return, volatility and Sharpe ratio (and turnover and
+    cost drag when given) over window periods, from cumulative sums of the
+    returns and of their squares.
+
+    Output: DataFrame indexed like value from start on, NaN until a full
+    window is available
+    """
+    index = value.index[max(start, 1):] if isinstance(value, (pd.Series, pd.DataFrame)) else None
+    returns = periodReturns(value, capital, start)
+    n = len(returns)
+    # centred on the full sample mean, the variance from sums of squares then loses no precision
+    centred = returns - (returns.mean() if n else 0.)
+    s1 = np.r_[0., np.cumsum(centred)]
+    s2 = np.r_[0., np.cumsum(centred ** 2)]
+    full = np.arange(n) >= window - 1
+    hi = np.arange(1, n + 1)
+    lo = np.maximum(hi - window, 0)
+    sum1, sum2 = s1[hi] - s1[lo], s2[hi] - s2[lo]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        mean = np.where(full, sum1 / window + (returns.mean() if n else 0.), np.nan)
+        var = np.maximum(sum2 - sum1 ** 2 / window, 0) / (window - 1)
+        std = np.where(full, np.sqrt(var), np.nan)
+        result = {"annual_return": mean * periods,
+                  "volatility": std * np.sqrt(periods),
+                  "sharpe": np.where(std > 0, mean / std * np.sqrt(periods), np.nan)}
+    for name, series in (("turnover", turnover), ("cost_drag", cost_paid)):
+        if series is not None:
+            values = np.nan_to_num(np.asarray(series, dtype = np.float64)[max(start, 1):])
+            cum = np.r_[0., np.cumsum(values)]
+            result[name] = np.where(full, (cum[hi] - cum[lo]) / capital * periods / window, np.nan)
+    return pd.DataFrame(result, index = index)
+
+
+def openPositions(shares, holding):
+    """
+    Shares held at the end of each period: the tranches opened in the last
+    holding periods, a rolling sum of the shares opened, by cumulative sums
+    """
+    shares = np.nan_to_num(np.asarray(shares, dtype = np.float64))
+    cum = np.cumsum(shares, axis = 0)
+    held = cum.copy()
+    held[holding:] -= cum[:-holding]
+    return held
+
+
+def industryContribution(strat, periods = 12):
+    """
+    Annualized P&L over capital contributed by each industry: the shares held
+    over a period times the change of the last traded price, summed by the
+    industry of the stock at the start of the period. The bid ask spread and
+    the costs are not allocated to industries.
+
+    Output: Series indexed by the industries of ind_list plus "Unlisted" for
+    the stocks outside ind_list
+    """
+    price = strat.price.ffill().to_numpy(dtype = np.float64)
+    held = openPositions(strat.shares, strat.holding)
+    pnl = np.nan_to_num(held[:-1] * np.diff(price, axis = 0))
+    codes = strat.codes()[:-1]
+    nList = len(strat.ind_list)
+    group = np.where((codes >= 0) & (codes < nList), codes, nList)
+    total = np.bincount(group.ravel(), weights = pnl.ravel(), minlength = nList + 1)
+    years = max(len(price) - strat.forming, 1) / periods
+    return pd.Series(total / strat.capital / years, index = list(strat.ind_list) + ["Unlisted"])
+
+
+def strategyMetrics(strat, periods = 12):
+    """
+    performanceMetrics of a strategy after run()
+    """
+    return performanceMetrics(strat.value, strat.capital, strat.forming, getattr(strat, "turnover", None),
+                              getattr(strat, "cost_paid", None), periods)
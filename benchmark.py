@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Statistical Arbitrage Team Project
+
+@author: Fan Chen, Zhijiang Huang, Fei Li, Zhixian Lin
+
+Benchmarks of the pipeline on synthetic data (see synthData), over a grid of
+ticker and month counts, with baselines stored as json to catch regressions.
+
+    python benchmark.py --tickers 100 300 1000 --months 60 120 240 --save baseline.json
+    python benchmark.py --tickers 100 300 1000 --months 60 120 240 --baseline baseline.json
+
+Every run also checks the startup cost of the backtest modules: importing
+them in a fresh interpreter has to stay under an import time budget and must
+not pull in the plotting and statistics libraries. The check alone, e.g. for
+the batch scheduler:
+
+    python benchmark.py --import-only --import-budget 1.0
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+from synthData import writeDataRoot
+from data import getMergeData, getFiveFactorData, get10IndustryPort, mapSector
+from initValidation import regressFactorModel
+from panel import buildPanel, attachIndustrySignal, broadcastIndustrySignal
+from Filter import long_short_filter, ranking_filter, long_ranking_filter, equal_weight, PANEL_FILTERS
+from Strategy import SectorRotationStrategy
+from Cost import LinearCost
+
+FILTERS = [long_short_filter, ranking_filter, long_ranking_filter, equal_weight]
+
+SIZES = [(100, 60), (300, 120), (1000, 240)]
+
+# what a backtest imports, the seconds it may take and the libraries it must not load
+IMPORT_MODULES = ["Strategy", "Filter", "Cost", "data"]
+IMPORT_BUDGET = 1.0
+HEAVY_MODULES = ["matplotlib", "scipy", "statsmodels"]
+
+
+def timeIt(func, repeat = 3):
+    """
+    Best wall clock time of repeat calls of func, in seconds
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def prepareInputs(root):
+    """
+    Load a synthetic data root and build what the benchmarks run on.
+
+    Output: dict with the merged data, the factor and industry data, the
+    industry alphas and the strategy panels (price, bid, ask, alpha, industry)
+    """
+    mergeDf = getMergeData(root, useCache = False).rename(columns = {"date": "Month"})
+    fiveFactor = getFiveFactorData(root, useCache = False)
+    ind10 = get10IndustryPort(root, useCache = False)
+    alpha = regressFactorModel(fiveFactor.iloc[:, 0:6], ind10, fiveFactor[["Month", "RF"]])["Alpha"]
+    panel = buildPanel(mergeDf, ["prc", "bidlo", "askhi", "Industry"], universe = ["prc", "bidlo", "askhi"])
+    # the alpha of each stock's industry that month
+    panel = attachIndustrySignal(panel, alpha, "Alpha")
+    return {"root": root, "mergeDf": mergeDf, "fiveFactor": fiveFactor, "ind10": ind10,
+            "ind_list": ind10.columns[1:], "industryAlpha": alpha, "panel": panel,
+            "frames": {field: panel.frame(field).reset_index(drop = True) for field in panel.fields}}
+
+
+def runStrategy(inputs):
+    frames = inputs["frames"]
+    strat = SectorRotationStrategy(frames["prc"], frames["bidlo"], frames["askhi"], frames["Alpha"],
+                                   frames["Industry"], 6, 1, long_ranking_filter, equal_weight,
+                                   LinearCost(0.001), inputs["ind_list"])
+    strat.run()
+    return strat
+
+
+def benchmarks(inputs):
+    """
+    The benchmarks on one data root: dict name -> function of no argument
+    """
+    fiveFactor, ind10 = inputs["fiveFactor"], inputs["ind10"]
+    alpha = inputs["frames"]["Alpha"].to_numpy()
+    cases = {"getMergeData": lambda: getMergeData(inputs["root"], useCache = False),
+             "mapSector": lambda: mapSector(inputs["mergeDf"]),
+             "regressFactorModel": lambda: regressFactorModel(fiveFactor.iloc[:, 0:6], ind10, fiveFactor[["Month", "RF"]]),
+             "broadcastIndustrySignal": lambda: broadcastIndustrySignal(inputs["industryAlpha"], inputs["panel"]),
+             "SectorRotationStrategy.run": lambda: runStrategy(inputs)}
+    for fltr in FILTERS:
+        # one call per month, as the backtest calls them
+        cases["Filter." + fltr.__name__] = lambda fltr = fltr: [fltr(row) for row in alpha]
+        cases["Filter." + PANEL_FILTERS[fltr].__name__] = lambda fltr = fltr: PANEL_FILTERS[fltr](alpha)
+    return cases
+
+
+def runBenchmarks(sizes = SIZES, names = None, repeat = 3, seed = 0, workDir = None):
+    """
+    Time the benchmarks on synthetic data of each size.
+
+    Input:
+        - sizes: list of (nTicker, nMonth)
+        - names: (Default: None, meaning all) benchmarks to run
+        - repeat: (Default: 3) the best of repeat runs is kept
+        - seed: (Default: 0) seed of the synthetic data
+        - workDir: (Default: None, a temporary directory) where the synthetic
+        data roots are written, an existing root of the same size and seed is
+        reused
+
+    Output: DataFrame with benchmark, nTicker, nMonth, seconds
+    """
+    workDir = workDir or os.path.join(tempfile.gettempdir(), "stat-arb-bench")
+    rows = []
+    for nTicker, nMonth in sizes:
+        root = os.path.join(workDir, "n%d_t%d_s%d" % (nTicker, nMonth, seed))
+        if not os.path.exists(root):
+            writeDataRoot(root, nTicker, nMonth, seed)
+        inputs = prepareInputs(root)
+        for name, func in benchmarks(inputs).items():
+            if names is None or name in names:
+                rows.append({"benchmark": name, "nTicker": nTicker, "nMonth": nMonth,
+                             "seconds": timeIt(func, repeat)})
+    return pd.DataFrame(rows, columns = ["benchmark", "nTicker", "nMonth", "seconds"])
+
+
+def importTime(modules = IMPORT_MODULES, repeat = 3):
+    """
+    Time the import of modules in a fresh interpreter, without a data root
+    set, so nothing can be resolved at import.
+
+    Output: (best seconds of repeat runs, the HEAVY_MODULES it loaded)
+    """
+    script = ("import sys, time\n"
+              "start = time.perf_counter()\n"
+              "import %s\n"
+              "print(time.perf_counter() - start)\n"
+              "print(' '.join(m for m in %r if m in sys.modules))" % (", ".join(modules), HEAVY_MODULES))
+    env = {key: value for key, value in os.environ.items() if key != "STAT_ARB_DATA"}
+    best, heavy = np.inf, []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", script], capture_output = True, text = True, check = True,
+                             cwd = os.path.dirname(os.path.abspath(__file__)), env = env).stdout.split("\n")
+        best, heavy = min(best, float(out[0])), out[1].split()
+    return best, heavy
+
+
+def checkImportBudget(budget = IMPORT_BUDGET, modules = IMPORT_MODULES, repeat = 3):
+    """
+    Output: (ok, message), ok is False when importing modules takes more than
+    budget seconds or loads one of HEAVY_MODULES
+    """
+    seconds, heavy = importTime(modules, repeat)
+    ok = seconds <= budget and not heavy
+    message = "import %s: %.3f s (budget %.3f s)" % (", ".join(modules), seconds, budget)
+    if heavy:
+        message += ", loads " + ", ".join(heavy)
+    return ok, message
+
+
+def environment():
+    return {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "machine": platform.machine(), "node": platform.node()}
+
+
+def saveBaseline(results, path):
+    """
+    Store benchmark results, with the versions and machine they ran on, as json
+    """
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results.to_dict(orient = "records")}, f, indent = 1)
+
+
+def loadBaseline(path):
+    with open(path) as f:
+        return pd.DataFrame(json.load(f)["results"])
+
+
+def compareBaseline(results, baseline, tolerance = 1.5):
+    """
+    Compare benchmark results with a baseline.
+
+    Input:
+        - results, baseline: DataFrames from runBenchmarks / loadBaseline
+        - tolerance: (Default: 1.5) a benchmark more than tolerance times
+        slower than its baseline is a regression
+
+    Output: DataFrame with the baseline seconds, the ratio and a regression
+    flag, for the (benchmark, nTicker, nMonth) in both
+    """
+    keys = ["benchmark", "nTicker", "nMonth"]
+    df = pd.merge(results, baseline[keys + ["seconds"]].rename(columns = {"seconds": "baseline"}), on = keys)
+    df["ratio"] = df.seconds / df.baseline
+    df["regression"] = df.ratio > tolerance
+    return df
+
+
+def scaling(results):
+    """
+    Seconds of each benchmark by size, one row per benchmark, one column per
+    (nTicker, nMonth)
+    """
+    return results.pivot_table(index = "benchmark", columns = ["nTicker", "nMonth"], values = "seconds")
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmark the pipeline on synthetic data")
+    parser.add_argument("--tickers", type = int, nargs = "+", default = [n for n, _ in SIZES])
+    parser.add_argument("--months", type = int, nargs = "+", default = [t for _, t in SIZES])
+    parser.add_argument("--grid", action = "store_true", help = "every tickers x months pair instead of zipping them")
+    parser.add_argument("--only", nargs = "+", help = "benchmarks to run")
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--workdir", help = "where the synthetic data roots are kept")
+    parser.add_argument("--save", help = "write the results as a baseline json")
+    parser.add_argument("--baseline", help = "compare with a baseline json, exit 1 on a regression")
+    parser.add_argument("--tolerance", type = float, default = 1.5)
+    parser.add_argument("--import-budget", type = float, default = IMPORT_BUDGET,
+                        help = "seconds allowed to import %s, exit 1 above it" % ", ".join(IMPORT_MODULES))
+    parser.add_argument("--import-only", action = "store_true", help = "only check the import time budget")
+    args = parser.parse_args(argv)
+
+    importOk, message = checkImportBudget(args.import_budget, repeat = args.repeat)
+    print(message)
+    if args.import_only:
+        return 0 if importOk else 1
+
+    if args.grid:
+        sizes = [(n, t) for n in args.tickers for t in args.months]
+    else:
+        if len(args.tickers) != len(args.months):
+            parser.error("--tickers and --months need the same length, or use --grid")
+        sizes = list(zip(args.tickers, args.months))
+    results = runBenchmarks(sizes, args.only, args.repeat, args.seed, args.workdir)
+    print(scaling(results).to_string(float_format = "%.4f"))
+    if args.save:
+        saveBaseline(results, args.save)
+    if args.baseline:
+        compared = compareBaseline(results, loadBaseline(args.baseline), args.tolerance)
+        print(compared.to_string(float_format = "%.4f"))
+        if compared.regression.any():
+            return 1
+    return 0 if importOk else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Statistical Arbitrage Team Project
+
+@author: Fan Chen, Zhijiang Huang, Fei Li, Zhixian Lin
+
+Block bootstrap confidence intervals for the Sharpe ratio and mean return of
+a strategy, alone or against a benchmark. The resample indices of a chunk of
+resamples are drawn as one integer matrix and the metrics are computed on
+the whole resampled matrix at once. Chunks have their own random streams
+spawned from the seed, so the result does not depend on the number of
+processes the chunks run on.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+METHODS = ["stationary", "circular", "moving"]
+
+_shared = None      # returns and settings of the bootstrap, set once per worker
+
+
+def returnsFromValue(value, capital = None):
+    """
+    Periodic returns of a strategy value series.
+
+    Input:
+        - value: Series, the value of SectorRotationStrategy (P&L in dollars
+        starting at 0) or the "Portfolio Value" of validateInitStrategy
+        (compounded, starting at 1)
+        - capital: (Default: None) the capital of SectorRotationStrategy, the
+        returns are then the P&L over capital from the first non zero value.
+        None takes the percent change of a compounded value.
+
+    Output: Series of returns
+    """
+    if isinstance(value, pd.DataFrame):
+        value = value.iloc[:, 0]
+    value = value.astype(np.float64)
+    if capital is None:
+        return value.pct_change().iloc[1:]
+    started = np.flatnonzero(value.to_numpy() != 0)
+    if not len(started):
+        return value.iloc[:0]
+    return (value.diff() / capital).iloc[max(started[0], 1):]
+
+
+def benchmarkReturns(sp500, column = "Close"):
+    """
+    Monthly returns of the S&P 500 from getSP500Data, indexed by Month
+    (yyyymm), to pair with strategy returns indexed the same way
+    """
+    return sp500.set_index("Month")[column].astype(np.float64).pct_change().iloc[1:]
+
+
+def blockIndices(n, nResample, blockLength, method = "stationary", rng = None):
+    """
+    Resample indices of a block bootstrap, as one matrix.
+
+    Input:
+        - n: length of the series
+        - nResample: number of resamples
+        - blockLength: block length, the mean block length for "stationary"
+        - method: (Default: "stationary") "stationary" (Politis-Romano,
+        geometric block lengths, wrapping around), "circular" (fixed length
+        blocks wrapping around) or "moving" (fixed length blocks within the
+        series)
+        - rng: (Default: None) numpy Generator
+
+    Output: nResample x n int array of positions in the series
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    position = np.arange(n)
+    if method == "stationary":
+        newBlock = rng.random((nResample, n)) < 1. / blockLength
+        newBlock[:, 0] = True
+    elif method in ("circular", "moving"):
+        newBlock = np.broadcast_to(position % blockLength == 0, (nResample, n))
+    else:
+        raise ValueError("unknown method: %s, use one of %s" % (method, METHODS))
+    high = n if method != "moving" else max(n - blockLength + 1, 1)
+    starts = rng.integers(0, high, (nResample, n))
+    # each position continues the block started at the last new block position
+    blockStart = np.maximum.accumulate(np.where(newBlock, position, 0), axis = 1)
+    return (np.take_along_axis(starts, blockStart, axis = 1) + position - blockStart) % n
+
+
+def sharpe(returns, periods = 12):
+    """
+    Annualized Sharpe ratio of each row of a matrix of returns
+    """
+    std = returns.std(axis = -1, ddof = 1)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        return np.where(std > 0, returns.mean(axis = -1) / std * np.sqrt(periods), np.nan)
+
+
+def metrics(returns, benchmark = None, periods = 12):
+    """
+    Metrics of each row of a matrix of returns (and of the benchmark returns
+    of the same months).
+
+    Output: dict name -> vector, mean and sharpe of the strategy, and with a
+    benchmark its mean and sharpe, the mean excess return, the difference of
+    the Sharpe ratios and the information ratio
+    """
+    result = {"mean": returns.mean(axis = -1), "sharpe": sharpe(returns, periods)}
+    if benchmark is not None:
+        excess = returns - benchmark
+        result["benchmark_mean"] = benchmark.mean(axis = -1)
+        result["benchmark_sharpe"] = sharpe(benchmark, periods)
+        result["excess_mean"] = excess.mean(axis = -1)
+        result["sharpe_diff"] = result["sharpe"] - result["benchmark_sharpe"]
+        result["information_ratio"] = sharpe(excess, periods)
+    return result
+
+
+def _bootstrapChunk(task):
+    """
+    Metrics of one chunk of resamples.
+    """
+    seed, nResample = task
+    returns, benchmark, blockLength, method, periods = _shared
+    index = blockIndices(len(returns), nResample, blockLength, method, np.random.default_rng(seed))
+    return metrics(returns[index], None if benchmark is None else benchmark[index], periods)
+
+
+def _initWorker(shared):
+    global _shared
+    _shared = shared
+
+
+def blockBootstrap(returns, benchmark = None, nResample = 10000, blockLength = 6, method = "stationary",
+                   chunk = 5000, workers = 1, seed = 0, level = 0.95, periods = 12):
+    """
+    Block bootstrap of the Sharpe ratio and mean return of a strategy.
+
+    Input:
+        - returns: Series of periodic returns (see returnsFromValue)
+        - benchmark: (Default: None) Series of benchmark returns, e.g. the
+        S&P 500 of getSP500Data. Strategy and benchmark are resampled
+        together on their common, non missing, periods.
+        - nResample: (Default: 10000) number of resamples
+        - blockLength: (Default: 6) (mean) block length in periods
+        - method: (Default: "stationary") see blockIndices
+        - chunk: (Default: 5000) resamples per chunk, bounds the memory to
+        about chunk x len(returns) x 8 bytes per matrix
+        - workers: (Default: 1) number of processes, None uses every core
+        - seed: (Default: 0) the same seed gives the same result whatever the
+        number of workers
+        - level: (Default: 0.95) confidence level of the intervals
+        - periods: (Default: 12) periods per year, to annualize the Sharpe
+        ratios
+
+    Output: (summary, samples), summary is a DataFrame with one row per
+    metric: the estimate on the data, the bootstrap standard error, the
+    percentile interval and the two sided p-value of the metric being 0;
+    samples is a DataFrame with the metrics of every resample
+    """
+    global _shared
+    if benchmark is not None:
+        both = pd.concat([returns, benchmark], axis = 1, join = "inner").dropna()
+        returns, benchmark = both.iloc[:, 0].to_numpy(np.float64), both.iloc[:, 1].to_numpy(np.float64)
+    else:
+        returns = pd.Series(returns).dropna().to_numpy(np.float64)
+    if len(returns) < 2:
+        raise ValueError("need at least 2 returns to bootstrap")
+
+    sizes = [min(chunk, nResample - start) for start in range(0, nResample, chunk)]
+    tasks = list(zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes))
+    shared = (returns, benchmark, blockLength, method, periods)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) == 1:
+        _shared = shared
+        try:
+            results = [_bootstrapChunk(task) for task in tasks]
+        finally:
+            _shared = None
+    else:
+        with ProcessPoolExecutor(max_workers = workers, initializer = _initWorker, initargs = (shared,)) as pool:
+            results = list(pool.map(_bootstrapChunk, tasks))
+    samples = pd.DataFrame({name: np.concatenate([r[name] for r in results]) for name in results[0]})
+
+    estimate = metrics(returns[None, :], None if benchmark is None else benchmark[None, :], periods)
+    lower, upper = (1 - level) / 2, (1 + level) / 2
+    summary = pd.DataFrame({"estimate": {name: value[0] for name, value in estimate.items()},
+                            "std_error": samples.std(ddof = 1),
+                            "lower": samples.quantile(lower),
+                            "upper": samples.quantile(upper),
+                            "p_value": np.minimum(1., 2 * np.minimum((samples <= 0).mean(), (samples >= 0).mean()))})
+    return summary.loc[samples.columns], samples
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Statistical Arbitrage Team Project
+
+@author: Fan Chen, Zhijiang Huang, Fei Li, Zhixian Lin
+
+On-disk cache for the cleaned output of the csv loaders in data.py. Each
+frame is stored column by column in a NumPy .npz file, keyed on the source
+file's path, size and mtime and on the source code of the cleaning function,
+so editing the csv or the cleaning code triggers a rebuild.
+"""
+
+import os
+import time
+import hashlib
+import inspect
+
+import numpy as np
+import pandas as pd
+
+# bump to invalidate every cache file, e.g. when the storage format changes
+CACHE_VERSION = 1
+
+cacheLog = []       # one entry per cached load: name, status (hit / miss / rebuild), seconds
+
+
+def getCacheDir():
+    """
+    The cache directory: $STAT_ARB_CACHE, else ~/.cache/stat-arb
+    """
+    path = os.environ.get("STAT_ARB_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "stat-arb")
+    os.makedirs(path, exist_ok = True)
+    return path
+
+
+def codeVersion(func):
+    """
+    Hash of the source code of the cleaning function.
+    """
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = func.__code__.co_code.hex()
+    return hashlib.sha1(source.encode()).hexdigest()
+
+
+def cacheKey(sourcePath, cleaner):
+    stat = os.stat(sourcePath)
+    ident = "|".join([os.path.abspath(sourcePath), str(stat.st_size), str(stat.st_mtime_ns),
+                      codeVersion(cleaner), str(CACHE_VERSION)])
+    return hashlib.sha1(ident.encode()).hexdigest()[:16]
+
+
+def saveFrame(df: pd.DataFrame, path):
+    """
+    Write a DataFrame to path as a columnar .npz. Columns of strings are stored
+    as fixed width unicode arrays plus a missing mask, categoricals as codes
+    plus categories, other object columns as object arrays.
+    """
+    arrays = {"__columns__": np.array([str(c) for c in df.columns]),
+              "__index__": df.index.to_numpy()}
+    for j, name in enumerate(df.columns):
+        col = df.iloc[:, j]
+        key = "c%d" % j
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            arrays[key + "_codes"] = col.cat.codes.to_numpy()
+            arrays[key + "_categories"] = col.cat.categories.to_numpy()
+        elif col.dtype == object or pd.api.types.is_string_dtype(col.dtype):
+            values = col.to_numpy(dtype = object)
+            missing = pd.isnull(values)
+            if all(isinstance(x, str) for x in values[~missing]):
+                arrays[key + "_str"] = np.where(missing, "", values).astype(str)
+                arrays[key + "_missing"] = missing
+            else:
+                arrays[key + "_obj"] = values
+        else:
+            arrays[key] = col.to_numpy()
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+def loadFrame(path, columns = None):
+    """
+    Read a DataFrame written by saveFrame, optionally only some of its columns.
+    """
+    with np.load(path, allow_pickle = True) as f:
+        allNames = f["__columns__"].tolist()
+        names = allNames if columns is None else [name for name in allNames if name in columns]
+        data = {}
+        for name in names:
+            key = "c%d" % allNames.index(name)
+            if key in f:
+                data[name] = f[key]
+            elif key + "_codes" in f:
+                data[name] = pd.Categorical.from_codes(f[key + "_codes"], categories = f[key + "_categories"])
+            elif key + "_str" in f:
+                values = f[key + "_str"].astype(object)
+                values[f[key + "_missing"]] = np.nan
+                data[name] = values
+            else:
+                data[name] = f[key + "_obj"]
+        index = f["__index__"]
+    return pd.DataFrame(data, index = index, columns = names)
+
+
+def cachedRead(name, sourcePath, cleaner = None, useCache = True, **readArgs):
+    """
+    Return cleaner(pd.read_csv(sourcePath)), from the cache when it is up to date.
+
+    Input:
+        - name: name of the data set, used for the cache file name and the log
+        - sourcePath: the csv file
+        - cleaner: (Default: None) function applied to the raw frame
+        - useCache: (Default: True) False always reads the csv and leaves the cache alone
+        - readArgs: passed to pd.read_csv
+    """
+    cleaner = cleaner or (lambda df: df)
+    if not useCache:
+        return cleaner(pd.read_csv(sourcePath, **readArgs))
+    start = time.perf_counter()
+    cacheDir = getCacheDir()
+    # one cache entry per data set and source file, a rebuild only replaces the entry of the same file
+    prefix = "%s-%s-" % (name, hashlib.sha1(os.path.abspath(sourcePath).encode()).hexdigest()[:8])
+    cacheFile = os.path.join(cacheDir, prefix + cacheKey(sourcePath, cleaner) + ".npz")
+    if os.path.exists(cacheFile):
+        df = loadFrame(cacheFile)
+        status = "hit"
+    else:
+        stale = [f for f in os.listdir(cacheDir) if f.startswith(prefix) and f.endswith(".npz")]
+        df = cleaner(pd.read_csv(sourcePath, **readArgs))
+        saveFrame(df, cacheFile)
+        for f in stale:
+            os.remove(os.path.join(cacheDir, f))
+        status = "rebuild" if stale else "miss"
+    cacheLog.append({"name": name, "status": status, "seconds": time.perf_counter() - start})
+    return df
+
+
+def cacheStats():
+    """
+    The cache log as a DataFrame, one row per cached load.
+    """
+    return pd.DataFrame(cacheLog, columns = ["name", "status", "seconds"])
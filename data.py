@@ -9,17 +9,43 @@ import numpy  as np
 import pandas as pd
 import platform
 import os
+import configparser
+import time
 from datetime import timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import cachedRead, saveFrame, loadFrame
 
 # MOM_LAG = 4
 
+# relative paths of the raw files under the data root, by source name (see SOURCES)
+DATA_FILES = {"crsp": os.path.join("Project Data", "crsp.CSV"),
+              "compustat": os.path.join("Project Data", "compustat.CSV"),
+              "sic": os.path.join("Project Data", "sic_code.csv"),
+              "cleanData": os.path.join("Project Data", "cache_clean_data.CSV"),
+              "fiveFactor": os.path.join("Validation Data", "F-F_Research_Data_5_Factors_2x3.CSV"),
+              "ind5": os.path.join("Validation Data", "5_Industry_Portfolios.CSV"),
+              "ind10": os.path.join("Validation Data", "10_Industry_Portfolios.CSV"),
+              "ind49": os.path.join("Validation Data", "49_Industry_Portfolios.CSV"),
+              "sp500": os.path.join("Validation Data", "SP500.csv")}
+
 def convertMonthToContinuous(monthIndex):
     return (monthIndex // 100) + (monthIndex % 100 / 12)    
 
 def getDropboxLoc():
     """
-    get the drop box location on each computer.
+    get the data root: $STAT_ARB_DATA, else data_root in the [paths] section of
+    the config file ($STAT_ARB_CONFIG or ~/.statarb.ini), else the drop box 
+    location of the computers we know.
     """
+    path = os.environ.get("STAT_ARB_DATA")
+    if path:
+        return path
+    config = configparser.ConfigParser()
+    config.read(os.environ.get("STAT_ARB_CONFIG") or os.path.join(os.path.expanduser("~"), ".statarb.ini"))
+    if config.has_option("paths", "data_root"):
+        return config.get("paths", "data_root")
     compNode =  platform.node()
     if compNode == "DESKTOP-5R528PV":
         path = "C:\\Users\\chenf\\Dropbox\\Stat Arb Data"
@@ -29,9 +55,23 @@ def getDropboxLoc():
         path = "C:\\Users\\Alex Huang\\Dropbox\\Stat Arb Data"
     elif compNode == "apple-PC.wv.cc.cmu.edu":
         path = "/Users/Fei/Dropbox/Stat Arb Data"
+    else:
+        raise RuntimeError("unknown data root on %s, set STAT_ARB_DATA or data_root in ~/.statarb.ini" % compNode)
     return path
 
-dropboxPath = getDropboxLoc()
+_dataRoot = None     # the data root, looked up on first use
+
+def dataRoot(path = None):
+    """
+    The data root the loaders read from: path when given, else getDropboxLoc(),
+    looked up the first time a loader needs it and kept for the session.
+    """
+    global _dataRoot
+    if path is not None:
+        return path
+    if _dataRoot is None:
+        _dataRoot = getDropboxLoc()
+    return _dataRoot
 
 def cleanFrenchData(df):
     # -99.99 is the missing value of the French data
@@ -47,10 +87,9 @@ def cleanCRSP(df):
     # change all the column names to lower case
     df.columns = [x.lower() for x in list(df)]
     # change negative bid, ask, price numbers
-    changeneg = lambda x:np.nan if x <= 0 else x
-    df.bidlo = df.bidlo.apply(changeneg)
-    df.askhi = df.askhi.apply(changeneg)
-    df.prc = df.prc.apply(changeneg)
+    df.bidlo = df.bidlo.where(df.bidlo > 0)
+    df.askhi = df.askhi.where(df.askhi > 0)
+    df.prc = df.prc.where(df.prc > 0)
     return df
 
 def cleanCompustat(df):
@@ -62,13 +101,12 @@ def cleanCompustat(df):
     # change the datadate column name to date
     df = df.rename(columns = {'datadate':'date'})
     # delete the last digit of cusip so that it can be merged with crsp data
-    killdigit = lambda x:x[:-1]
-    df["cusip"] = df["cusip"].apply(killdigit)
+    df["cusip"] = df["cusip"].str[:-1]
     return df
 
 def cleanMergeData(df):
     # Remove useless columns
-    df = df.drop(labels = ['permno', 'exchcd', 'ncusip', 'permco', 'spread', 'altprc', 'spread', 'gvkey', 'fyearq', 'fqtr', 'indfmt', 'consol', 'popsrc', 'datafmt', 'tic', 'curcdq', 'datacqtr', 'datafqtr', 'exchg', 'costat', 'mkvaltq', 'naics_y'], axis=1)
+    df = df.drop(labels = ['permno', 'exchcd', 'ncusip', 'permco', 'spread', 'altprc', 'spread', 'gvkey', 'fyearq', 'fqtr', 'indfmt', 'consol', 'popsrc', 'datafmt', 'tic', 'curcdq', 'datacqtr', 'datafqtr', 'exchg', 'costat', 'mkvaltq', 'naics_y'], axis=1, errors = "ignore")
     # change the naics_x column name to naics
     df= df.rename(columns = {'naics_x': 'naics'})
     # use cumulative factor to adjust price to adjust price
@@ -77,8 +115,7 @@ def cleanMergeData(df):
     df.askhi  /= df.cfacpr
     df.shrout /= df.cfacshr
     df = df.drop(labels = ['cfacpr', 'cfacshr'], axis = 1)
-    # forward fill data
-    df[['atq', 'cshprq','epspxq']] = df[['atq', 'cshprq', 'epspxq']].ffill()
+    # atq, cshprq and epspxq are already the latest filing of the same company (see asofMerge)
     # calculate Book to Market ratio
     df['b2m'] = df['prc']*df['shrout']/(1000*df['atq'])
     # calculate the momentum measure as the return from the previous month minus MOM_LAG numbers of months
@@ -87,183 +124,307 @@ def cleanMergeData(df):
 #    df = mapSector(df)
     return df
 
-def getFiveFactorData(path = dropboxPath, dataPath = os.path.join("Validation Data", "F-F_Research_Data_5_Factors_2x3.CSV")):
-    df = pd.read_csv(os.path.join(path, dataPath))
-    return cleanFrenchData(df)
+def cleanSP500(df):
+    # month of the observation, the prices are dated the first day of the next month
+    df["Month"] = df.Date.apply(pd.Timestamp) - timedelta(days = 1)
+    df.Month = df.Month.astype(str).apply(lambda x: int(x[0:4] + x[5:7]))
+    return df
 
-def get5IndustryPort(path = dropboxPath, dataPath = os.path.join("Validation Data", "5_Industry_Portfolios.CSV")):
-    df = pd.read_csv(os.path.join(path, dataPath))
-    return cleanFrenchData(df)
+def getFiveFactorData(path = None, dataPath = DATA_FILES["fiveFactor"], useCache = True):
+    return cachedRead("fiveFactor", os.path.join(dataRoot(path), dataPath), cleanFrenchData, useCache)
 
-def get10IndustryPort(path = dropboxPath, dataPath = os.path.join("Validation Data", "10_Industry_Portfolios.CSV")):
-    df = pd.read_csv(os.path.join(path, dataPath))
-    return cleanFrenchData(df)
+def get5IndustryPort(path = None, dataPath = DATA_FILES["ind5"], useCache = True):
+    return cachedRead("ind5", os.path.join(dataRoot(path), dataPath), cleanFrenchData, useCache)
 
-def get49IndustryPort(path = dropboxPath, dataPath = os.path.join("Validation Data", "49_Industry_Portfolios.CSV")):
-    df = pd.read_csv(os.path.join(path, dataPath))
-    return cleanFrenchData(df)
+def get10IndustryPort(path = None, dataPath = DATA_FILES["ind10"], useCache = True):
+    return cachedRead("ind10", os.path.join(dataRoot(path), dataPath), cleanFrenchData, useCache)
 
-def getSP500Data(path = dropboxPath, dataPath = os.path.join("Validation Data", "SP500.csv")):
-    df = pd.read_csv(os.path.join(path, dataPath))
-    df["Month"] = df.Date.apply(pd.Timestamp) - timedelta(days = 1)
-    df.Month = df.Month.astype(str).apply(lambda x: int(x[0:4] + x[5:7]))
-    return df
+def get49IndustryPort(path = None, dataPath = DATA_FILES["ind49"], useCache = True):
+    return cachedRead("ind49", os.path.join(dataRoot(path), dataPath), cleanFrenchData, useCache)
 
-def getSIC(path = dropboxPath, dataPath = os.path.join("Project Data","sic_code.csv") ):
-    df = pd.read_csv(os.path.join(path, dataPath))
-    return df
+def getSP500Data(path = None, dataPath = DATA_FILES["sp500"], useCache = True):
+    return cachedRead("sp500", os.path.join(dataRoot(path), dataPath), cleanSP500, useCache)
 
-def getCRSP(path = dropboxPath, dataPath = os.path.join("Project Data","crsp.CSV")): 
-    df = pd.read_csv(os.path.join(path, dataPath))
-    return cleanCRSP(df)
+def getSIC(path = None, dataPath = DATA_FILES["sic"], useCache = True):
+    return cachedRead("sic", os.path.join(dataRoot(path), dataPath), None, useCache)
 
-def getCompustat(path = dropboxPath, dataPath = os.path.join("Project Data","compustat.CSV")):
-    df = pd.read_csv(os.path.join(path, dataPath))
-    return cleanCompustat(df)
+def getCRSP(path = None, dataPath = DATA_FILES["crsp"], useCache = True): 
+    return cachedRead("crsp", os.path.join(dataRoot(path), dataPath), cleanCRSP, useCache)
 
-def getMergeData():
-    cleanData = cleanMergeData(pd.merge(getCRSP(), getCompustat(), on=['cusip', 'date'], how = "left"))
-    sicDf  = getSIC()
+# raw CRSP columns kept by the streaming ingest and their types
+CRSP_DTYPES = {"PERMNO": np.int64, "date": np.int64, "NAICS": np.float64, "TICKER": object, "CUSIP": object,
+               "BIDLO": np.float64, "ASKHI": np.float64, "PRC": np.float64, "SHROUT": np.float64,
+               "CFACPR": np.float64, "CFACSHR": np.float64}
+
+def peakRSS():
+    """
+    high-water mark of the resident memory of this process in MB: VmHWM of
+    /proc/self/status, else ru_maxrss, NaN where neither is available
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    try:
+        import resource, sys
+    except ImportError:
+        return np.nan
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def streamCRSP(outDir, path = None, dataPath = DATA_FILES["crsp"], chunksize = 500000, dtypes = CRSP_DTYPES):
+    """
+    Clean the CRSP file chunk by chunk into a store of part files, so memory 
+    is bounded by the chunk size instead of the file size.
+    
+    Input:
+        - outDir: directory of the store, existing parts are replaced
+        - chunksize: (Default: 500000) rows per chunk
+        - dtypes: (Default: CRSP_DTYPES) the columns to read and their types,
+        names are matched to the csv header case-insensitively
+    
+    Output: dict with rows, chunks, seconds and peakRSS (MB, the high-water
+    mark of the process at the end, see peakRSS)
+    """
+    start = time.perf_counter()
+    source = os.path.join(dataRoot(path), dataPath)
+    header = pd.read_csv(source, nrows = 0).columns
+    wanted = {name.lower(): dtype for name, dtype in dtypes.items()}
+    usecols = [name for name in header if name.lower() in wanted]
+    os.makedirs(outDir, exist_ok = True)
+    for f in os.listdir(outDir):
+        if f.startswith("part-") and f.endswith(".npz"):
+            os.remove(os.path.join(outDir, f))
+    rows, chunks = 0, 0
+    reader = pd.read_csv(source, usecols = usecols, dtype = {name: wanted[name.lower()] for name in usecols},
+                         chunksize = chunksize)
+    for chunk in reader:
+        chunk = cleanCRSP(chunk)
+        saveFrame(chunk, os.path.join(outDir, "part-%05d.npz" % chunks))
+        rows += len(chunk)
+        chunks += 1
+        del chunk
+    return {"rows": rows, "chunks": chunks, "seconds": time.perf_counter() - start, "peakRSS": peakRSS()}
+
+def loadCRSPStore(storeDir, columns = None):
+    """
+    Read a store written by streamCRSP, optionally only some of its columns.
+    """
+    parts = sorted(f for f in os.listdir(storeDir) if f.startswith("part-") and f.endswith(".npz"))
+    return pd.concat([loadFrame(os.path.join(storeDir, f), columns) for f in parts])
+
+def getCompustat(path = None, dataPath = DATA_FILES["compustat"], useCache = True):
+    return cachedRead("compustat", os.path.join(dataRoot(path), dataPath), cleanCompustat, useCache)
+
+# loaders of the data sources by name, each takes (path, useCache = useCache)
+SOURCES = OrderedDict([("crsp", getCRSP), ("compustat", getCompustat), ("sic", getSIC),
+                       ("fiveFactor", getFiveFactorData), ("ind5", get5IndustryPort), ("ind10", get10IndustryPort),
+                       ("ind49", get49IndustryPort), ("sp500", getSP500Data)])
+
+def _timedLoad(loader, path, useCache):
+    start = time.perf_counter()
+    df = loader(path, useCache = useCache)
+    return df, time.perf_counter() - start
+
+def loadSources(names = ("crsp", "compustat", "sic"), path = None, useCache = True, workers = None):
+    """
+    Load and clean independent data sources concurrently on a thread pool, 
+    the csv parser releases the GIL so the reads overlap.
+    
+    Input:
+        - names: (Default: the sources of getMergeData) keys of SOURCES
+        - path: (Default: None, meaning dataRoot()) the data root
+        - useCache: (Default: True) passed to the loaders
+        - workers: (Default: None, one thread per source) 1 loads them one 
+        after another
+    
+    Output: (bundle, timing), bundle is a dict name -> DataFrame, timing a 
+    Series with the seconds of each source, their sum and the wall clock 
+    time of the whole load, the overlap win being sum / wall
+    """
+    unknown = [name for name in names if name not in SOURCES]
+    if unknown:
+        raise ValueError("unknown sources: %s, use some of %s" % (unknown, list(SOURCES)))
+    # resolved here, not by each thread
+    path = dataRoot(path)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = workers or len(names) or 1) as pool:
+        futures = OrderedDict((name, pool.submit(_timedLoad, SOURCES[name], path, useCache)) for name in names)
+        results = OrderedDict((name, future.result()) for name, future in futures.items())
+    wall = time.perf_counter() - start
+    timing = pd.Series(OrderedDict((name, seconds) for name, (_, seconds) in results.items()))
+    timing["sum"] = timing.sum()
+    timing["wall"] = wall
+    return OrderedDict((name, df) for name, (df, _) in results.items()), timing
+
+def securityKey(code, date):
+    """
+    int64 key that sorts by security then month, -1 where either is missing
+    """
+    date = pd.Series(date)
+    if not pd.api.types.is_numeric_dtype(date):
+        date = pd.to_numeric(date, errors = "coerce")
+    date = date.to_numpy(dtype = np.float64)
+    valid = (code >= 0) & ~np.isnan(date)
+    return np.where(valid, code * 1000000 + np.where(valid, date, 0).astype(np.int64), -1)
+
+def asofMerge(crsp, compustat, sicDf):
+    """
+    Attach to every CRSP row the latest Compustat filing of the same security 
+    on or before that month, and the SIC code of the security that month.
+    
+    cusip is encoded to integer codes once and all three frames are keyed by
+    (security, month) integers, so the joins are searchsorted lookups on 
+    sorted keys instead of hash merges on strings. Columns in both CRSP and 
+    Compustat get the _x / _y suffixes of pd.merge.
+    
+    Output: DataFrame sorted by (cusip, date), rows without a cusip first, 
+    with the CRSP columns, the Compustat columns and SICCD (float, NaN if 
+    missing or not numeric)
+    """
+    nC, nQ = len(crsp), len(compustat)
+    # sorted codes, so the security order is the cusip order
+    codes, _ = pd.factorize(pd.concat([crsp.cusip, compustat.cusip, sicDf.CUSIP], ignore_index = True), sort = True)
+    crspKey = securityKey(codes[:nC], crsp.date)
+    compKey = securityKey(codes[nC:nC + nQ], compustat.date)
+    sicKey  = securityKey(codes[nC + nQ:], sicDf.date)
+    
+    order = np.argsort(crspKey, kind = "stable")
+    crspKey = crspKey[order]
+    
+    # Compustat: last filing with key <= the CRSP key, of the same security
+    compOrder = np.argsort(compKey, kind = "stable")
+    compKey = compKey[compOrder]
+    idx = np.searchsorted(compKey, crspKey, side = "right") - 1
+    safe = np.maximum(idx, 0)
+    hit = (crspKey >= 0) & (idx >= 0) & (compKey[safe] >= 0) & (compKey[safe] // 1000000 == crspKey // 1000000)
+    rows = compOrder[safe]
+    del compKey, idx, safe
+    
+    # SIC: exact (security, month) match
+    sicOrder = np.argsort(sicKey, kind = "stable")
+    j = np.searchsorted(sicKey[sicOrder], crspKey, side = "left")
+    # a sentinel at the end keeps j in range when the key is past the last one
+    sicKey = np.r_[sicKey[sicOrder], -2]
+    # SICCD has a few thousand distinct values, coerce those and not every row
+    sicCodes, sicValues = pd.factorize(sicDf.SICCD)
+    sicValues = np.r_[pd.to_numeric(pd.Series(sicValues), errors = "coerce").to_numpy(dtype = np.float64), np.nan]
+    sic = np.r_[sicValues[sicCodes[sicOrder]], np.nan]
+    
+    # gather column by column into one frame, no intermediate frames
+    compCols = [c for c in compustat.columns if c not in ("cusip", "date")]
+    common = set(compCols) & set(crsp.columns)
+    columns = {}
+    for c in crsp.columns:
+        columns[c + "_x" if c in common else c] = crsp[c].iloc[order].reset_index(drop = True)
+    for c in compCols:
+        values = np.take(compustat[c].to_numpy(), rows)
+        if not hit.all():
+            if values.dtype.kind in "iub":
+                values = values.astype(np.float64)
+            elif values.dtype.kind not in "fcmM":
+                values = values.astype(object)
+            values[~hit] = np.datetime64("NaT") if values.dtype.kind in "mM" else np.nan
+        columns[c + "_y" if c in common else c] = values
+    columns["SICCD"] = np.where((crspKey >= 0) & (sicKey[j] == crspKey), sic[j], np.nan)
+    res = pd.DataFrame(columns, copy = False)
+    return res
+
+def getMergeData(path = None, useCache = True):
+    sources, _ = loadSources(["crsp", "compustat", "sic"], path, useCache)
+    sicDf  = sources["sic"]
     sicDf.date = sicDf.date // 100
-    cleanData=  pd.merge(cleanData, sicDf[["date", "CUSIP", "SICCD"]].rename(columns = {"CUSIP": "cusip"}), on = ["cusip", "date"], how = "left")
-    def convertSIC(x):
-        try:
-            return int(x)
-        except:
-            return np.nan
-    cleanData.SICCD = cleanData.SICCD.apply(convertSIC)
+    cleanData = cleanMergeData(asofMerge(sources["crsp"], sources["compustat"], sicDf))
     cleanData = mapSector(cleanData)
     return cleanData
 
-def getCleanData(path = dropboxPath, dataPath = os.path.join("Project Data", "cache_clean_data.CSV")):
-    df = pd.read_csv(os.path.join(path, dataPath))
+def getCleanData(path = None, dataPath = DATA_FILES["cleanData"]):
+    df = pd.read_csv(os.path.join(dataRoot(path), dataPath))
     return df
 
-# Input a vector of NAICS codes
-# The function will map the codes to Fama French
-def mapSector(df):
-<<<<<<< HEAD
-    for i in range(len(df["naics"])):
-        if i % 1000 == 0:
-            print(i)
-        f4 = int(str(df["naics"][i])[:4])
-        ind = ""
-=======
-
-    def findSector(f4):
->>>>>>> ca5b0fb45614a76ae850a3c288b1f3052412b036
-        if 100 <= f4 <= 999:
-            ind = "NoDur"
-        elif 2000 <= f4 <= 2399:
-            ind = "NoDur"
-        elif 2700 <= f4 <= 2749:
-            ind = "NoDur"
-        elif 2770 <= f4 <= 2799:
-            ind = "NoDur"
-        elif 3100 <= f4 <= 3199:
-            ind = "NoDur"
-        elif 3940 <= f4 <= 3989: 
-            ind = "NoDur"
-        elif 2500 <= f4 <= 2519:
-            ind = "Durbl"
-        elif 2590 <= f4 <= 2599:
-            ind = "Durbl"
-        elif 3630 <= f4 <= 3659:
-            ind = "Durbl"
-        elif 3710 <= f4 <= 3711: 
-            ind = "Durbl"
-        elif 3714 <= f4 <= 3714:
-            ind = "Durbl"
-        elif 3716 <= f4 <= 3716:
-            ind = "Durbl"
-        elif 3750 <= f4 <= 3751: 
-            ind = "Durbl"
-        elif 3792 <= f4 <= 3792: 
-            ind = "Durbl"
-        elif 3900 <= f4 <= 3939:
-            ind = "Durbl"
-        elif 3990 <= f4 <= 3999: 
-            ind = "Durbl"
-        elif 2520 <= f4 <= 2589:
-            ind = "Manuf"
-        elif 2600 <= f4 <= 2699:
-            ind = "Manuf"
-        elif 2750 <= f4 <= 2769:
-            ind = "Manuf"
-        elif 2800 <= f4 <= 2829: 
-            ind = "Manuf"
-        elif 2840 <= f4 <= 2899: 
-            ind = "Manuf"
-        elif 3000 <= f4 <= 3099:
-            ind = "Manuf"
-        elif 3200 <= f4 <= 3569:
-            ind = "Manuf"
-        elif 3580 <= f4 <= 3621: 
-            ind = "Manuf"
-        elif 3623 <= f4 <= 3629: 
-            ind = "Manuf"
-        elif 3700 <= f4 <= 3709: 
-            ind = "Manuf"
-        elif 3712 <= f4 <= 3713: 
-            ind = "Manuf"
-        elif 3715 <= f4 <= 3715:
-            ind = "Manuf"
-        elif 3717 <= f4 <= 3749: 
-            ind = "Manuf"
-        elif 3752 <= f4 <= 3791:
-            ind = "Manuf"
-        elif 3793 <= f4 <= 3799:
-            ind = "Manuf"
-        elif 3860 <= f4 <= 3899:
-            ind = "Manuf"
-        elif 1200 <= f4 <= 1399: 
-            ind = "Enrgy"
-        elif 2900 <= f4 <= 2999:
-            ind = "Enrgy"
-        elif 3570 <= f4 <= 3579:
-            ind = "HiTec"
-        elif 3622 <= f4 <= 3622: 
-            ind = "HiTec"
-        elif 3660 <= f4 <= 3692: 
-            ind = "HiTec"
-        elif 3694 <= f4 <= 3699:
-            ind = "HiTec"
-        elif 3810 <= f4 <= 3839: 
-            ind = "HiTec"
-        elif 7370 <= f4 <= 7379: 
-            ind = "HiTec"
-        elif 7391 <= f4 <= 7391:
-            ind = "HiTec"
-        elif 8730 <= f4 <= 8734:
-            ind = "HiTec"
-        elif 4800 <= f4 <= 4899:
-            ind = "Telcm"
-        elif 5000 <= f4 <= 5999:
-            ind = "Shops"
-        elif 7200 <= f4 <= 7299:
-            ind = "Shops"
-        elif 7600 <= f4 <= 7699:
-            ind = "Shops"
-        elif 2830 <= f4 <= 2839:
-            ind = "Hlth"
-        elif 3693 <= f4 <= 3693:
-            ind = "Hlth"
-        elif 3840 <= f4 <= 3859: 
-            ind = "Hlth"
-        elif 8000 <= f4 <= 8099:
-            ind = "Hlth"
-        elif 4900 <= f4 <= 4949: 
-            ind = "Utils"
-        else:
-<<<<<<< HEAD
-            ind = "Other"
-        df["naics"][i]=ind 
-    df= df.rename(columns = {'naics': 'ffind'})
-=======
-            ind = "Other"        
-        return ind
+def sicTablePath(nIndustry = 10):
+    """
+    Path of the shipped industryTables/Siccodes<nIndustry>.txt, with an error
+    saying where to put it when it is missing (49 is not shipped)
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "industryTables", "Siccodes%d.txt" % nIndustry)
+    if not os.path.exists(path):
+        raise FileNotFoundError("no %d industry definition at %s: download Siccodes%d.txt from Kenneth French's "
+                                "data library (Detail for %d Industry Portfolios) into industryTables, or pass "
+                                "its path to loadSICTable" % (nIndustry, path, nIndustry, nIndustry))
+    return path
+
+def loadSICTable(nIndustry = 10, path = None):
+    """
+    Load a Fama-French SIC code definition as a sorted interval table.
+    
+    Input:
+        - nIndustry: (Default: 10) 5, 10 or 49, picks industryTables/Siccodes<nIndustry>.txt. 
+        The 49 industry definition is not shipped, put French's Siccodes49.txt
+        in industryTables or pass its path.
+        
+        - path: (Default: None) a definition file in the format of French's 
+        Siccodes*.txt, "<n> <name> <description>" lines followed by 
+        "<lo>-<hi>" SIC range lines. An industry without ranges is the default.
+    
+    Output: (lo, hi, code, categories, default) with disjoint ranges sorted by
+    lo, and code indexing into categories
+    """
+    if path is None:
+        path = sicTablePath(nIndustry)
+    categories, lo, hi, code = [], [], [], []
+    noRange = []
+    with open(path) as f:
+        for line in f:
+            token = line.split()
+            if not token:
+                continue
+            if token[0].isdigit() and len(token) > 1:
+                categories.append(token[1])
+                noRange.append(token[1])
+            elif "-" in token[0] and categories:
+                a, b = token[0].split("-")
+                lo.append(int(a))
+                hi.append(int(b))
+                code.append(len(categories) - 1)
+                if categories[-1] in noRange:
+                    noRange.remove(categories[-1])
+    default = noRange[-1] if noRange and "Other" not in noRange else "Other"
+    if default not in categories:
+        categories.append(default)
+    lo, hi, code = np.array(lo), np.array(hi), np.array(code)
+    # split into disjoint pieces, a piece covered by several ranges goes to
+    # the one listed first, like the old if/elif chain
+    edges = np.unique(np.r_[lo, hi + 1])
+    start, end = edges[:-1], edges[1:] - 1
+    cover = (lo[:, None] <= start[None, :]) & (hi[:, None] >= start[None, :])
+    keep = cover.any(axis = 0)
+    return start[keep], end[keep], code[cover.argmax(axis = 0)[keep]], categories, default
+
+def sicToIndustry(sic, nIndustry = 10, table = None):
+    """
+    Map SIC codes to Fama-French industries with one searchsorted over the
+    sorted range table. Codes outside every range, and missing codes, map to 
+    the default industry ("Other").
     
-    df["Industry"] = df.SICCD.apply(findSector)        
+    Input:
+        - sic: vector of SIC codes, non numeric values count as missing
+        - nIndustry: (Default: 10) granularity, see loadSICTable
+        - table: (Default: None) output of loadSICTable, loaded when None
     
->>>>>>> ca5b0fb45614a76ae850a3c288b1f3052412b036
-    return df
\ No newline at end of file
+    Output: Categorical of industries
+    """
+    lo, hi, code, categories, default = table if table is not None else loadSICTable(nIndustry)
+    sic = pd.to_numeric(pd.Series(sic), errors = "coerce").to_numpy(dtype = np.float64)
+    idx = np.searchsorted(lo, sic, side = "right") - 1
+    inside = (idx >= 0) & (sic <= hi[np.maximum(idx, 0)])
+    codes = np.where(inside, code[np.maximum(idx, 0)], categories.index(default))
+    return pd.Categorical.from_codes(codes, categories = categories)
+
+# Map the SIC codes of the data to Fama French industries
+def mapSector(df, nIndustry = 10):
+    df["Industry"] = sicToIndustry(df.SICCD, nIndustry)
+    return df
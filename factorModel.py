@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""
+Statistical Arbitrage Team Project
+
+@author: Fan Chen, Zhijiang Huang, Fei Li, Zhixian Lin
+
+Rolling factor-model regressions solved for every asset at once. The window
+statistics X'X, X'y and the observation count are built from running
+(cumulative) sums, so each month costs O(k^2) per asset instead of a fresh
+OLS fit.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+
+def prepareFactorData(factorDf: pd.DataFrame, indDf: pd.DataFrame, rfDf: pd.DataFrame):
+    """
+    Merge the factor, asset and risk free data on Month and turn the asset
+    returns into excess returns.
+
+    Output: (months, factorName, indName, X, Y) where X is the T x k factor
+    matrix and Y is the T x N excess return matrix, both float64.
+    """
+    assert factorDf.columns[0] == "Month"
+    assert indDf.columns[0] == "Month"
+
+    factorName = factorDf.columns[1:]
+    indName    = indDf.columns[1:]
+
+    mergeDf = pd.merge(factorDf, indDf, on = ["Month"])
+    mergeDf = pd.merge(mergeDf, rfDf, on = ["Month"])
+
+    X = mergeDf[factorName].to_numpy(dtype = np.float64)
+    Y = mergeDf[indName].to_numpy(dtype = np.float64) - mergeDf[["RF"]].to_numpy(dtype = np.float64)
+    return mergeDf["Month"], factorName, indName, X, Y
+
+
+# condition number of X'X above which a window is treated as rank deficient
+COND_LIMIT = 1e10
+
+
+def windowMoments(X, Y):
+    """
+    Per-observation contributions to the regression sufficient statistics.
+
+    Input:
+        - X: T x k factor matrix (without constant)
+        - Y: T x N asset return matrix, NaN where missing
+
+    Output: (xx, xy, cnt) with shapes T x N x K x K, T x N x K and T x N,
+    where K = k + 1 (the constant comes first). A month contributes zero to
+    an asset when either its return or any factor is missing.
+    """
+    T = X.shape[0]
+    Xc = np.empty((T, X.shape[1] + 1))
+    Xc[:, 0]  = 1.
+    Xc[:, 1:] = X
+    mask = np.isfinite(Y) & np.isfinite(Xc).all(axis = 1)[:, None]
+    Xc = np.where(np.isfinite(Xc), Xc, 0.)
+    y  = np.where(mask, Y, 0.)
+    m  = mask.astype(np.float64)
+    xx = np.einsum("tn,tk,tl->tnkl", m, Xc, Xc)
+    xy = np.einsum("tn,tk->tnk", y, Xc)
+    return xx, xy, m
+
+
+def solveWindow(xx, xy, cnt, min_period):
+    """
+    Solve the normal equations for a stack of windows.
+
+    Input: xx (... x K x K), xy (... x K), cnt (...). Windows with fewer
+    than min_period observations are returned as NaN. Rank deficient windows
+    (fewer than K observations, or X'X with a condition number above 
+    COND_LIMIT) get the minimum norm least squares solution of the 
+    pseudo-inverse, which is what statsmodels' OLS does, instead of what 
+    solve makes of a numerically singular X'X.
+
+    Output: coefficient array (... x K), intercept first.
+    """
+    K = xy.shape[-1]
+    coef = np.full(xy.shape, np.nan)
+    valid = cnt >= max(min_period, 1)
+    if not valid.any():
+        return coef
+    A = xx[valid]
+    b = xy[valid][..., None]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        deficient = (cnt[valid] < K) | ~(np.linalg.cond(A) <= COND_LIMIT)
+    sol = np.empty(b.shape[:-1])
+    # each window is solved on its own, its answer does not depend on the other windows of the batch
+    if (~deficient).any():
+        sol[~deficient] = np.linalg.solve(A[~deficient], b[~deficient])[..., 0]
+    if deficient.any():
+        # singular values of X'X below 1 / COND_LIMIT of the largest are round off of the cumulative sums
+        sol[deficient] = np.matmul(np.linalg.pinv(A[deficient], rcond = 1. / COND_LIMIT), b[deficient])[..., 0]
+    coef[valid] = sol.reshape(-1, K)
+    return coef
+
+
+def rollingOLS(X, Y, period = 36, min_period = 12, chunk = 512):
+    """
+    Rolling OLS of every column of Y on [1, X].
+
+    Input:
+        - X: T x k factor matrix
+
+        - Y: T x N asset return matrix, NaN where missing. Missing values are
+        dropped per column, like sm.OLS(missing = "drop").
+
+        - period: (Default: 36) length of the lookback window, the window
+        ending at row t covers rows t - period + 1, ..., t
+
+        - min_period: (Default: 12) minimum observations required
+
+        - chunk: (Default: 512) number of assets solved together, bounds the
+        T x chunk x K x K working memory
+
+    Output: T x N x (k + 1) coefficient array, intercept first. Rows before the
+    first full window are NaN.
+    """
+    X = np.asarray(X, dtype = np.float64)
+    Y = np.asarray(Y, dtype = np.float64)
+    T, N = Y.shape
+    K = X.shape[1] + 1
+    coef = np.full((T, N, K), np.nan)
+    if T < period:
+        return coef
+    for start in range(0, N, chunk):
+        cols = slice(start, min(start + chunk, N))
+        xx, xy, cnt = windowMoments(X, Y[:, cols])
+        # window sums as differences of cumulative sums
+        xx = np.cumsum(xx, axis = 0)
+        xy = np.cumsum(xy, axis = 0)
+        cnt = np.cumsum(cnt, axis = 0)
+        xx[period:] = xx[period:] - xx[:-period]
+        xy[period:] = xy[period:] - xy[:-period]
+        cnt[period:] = cnt[period:] - cnt[:-period]
+        coef[period - 1:, cols] = solveWindow(xx[period - 1:], xy[period - 1:], cnt[period - 1:], min_period)
+    return coef
+
+
+def _shareArray(arr):
+    """
+    Copy an array into a new shared memory block.
+
+    Output: (SharedMemory, view, spec) where spec = (name, shape, dtype) is
+    what a worker needs to attach to the block.
+    """
+    shm = shared_memory.SharedMemory(create = True, size = max(arr.nbytes, 1))
+    view = np.ndarray(arr.shape, dtype = arr.dtype, buffer = shm.buf)
+    view[...] = arr
+    return shm, view, (shm.name, arr.shape, arr.dtype.str)
+
+
+def _attachArray(spec):
+    name, shape, dtype = spec
+    try:
+        shm = shared_memory.SharedMemory(name = name, track = False)
+    except TypeError:       # python < 3.13 has no track argument
+        shm = shared_memory.SharedMemory(name = name)
+    return shm, np.ndarray(shape, dtype = np.dtype(dtype), buffer = shm.buf)
+
+
+def _rollingOLSWorker(xSpec, ySpec, coefSpec, start, stop, period, min_period, chunk):
+    """
+    Solve the assets start:stop and write them straight into the shared
+    coefficient panel. Only the slice bounds travel back to the parent.
+    """
+    blocks = [_attachArray(spec) for spec in (xSpec, ySpec, coefSpec)]
+    try:
+        X, Y, coef = (view for _, view in blocks)
+        coef[:, start:stop] = rollingOLS(X, Y[:, start:stop], period, min_period, chunk)
+    finally:
+        del X, Y, coef
+        for shm, _ in blocks:
+            shm.close()
+    return start, stop
+
+
+def parallelRollingOLS(X, Y, period = 36, min_period = 12, workers = None, chunk = 512, splits = None):
+    """
+    rollingOLS with the assets split across a process pool.
+
+    X, Y and the output panel live in shared memory, so workers neither
+    receive pickled copies of the returns nor send back their coefficients;
+    each one fills its own asset slice of the preallocated panel.
+
+    Input:
+        - X, Y, period, min_period, chunk: as in rollingOLS
+
+        - workers: (Default: None) number of processes, None uses every core
+
+        - splits: (Default: None) number of asset slices handed out, defaults
+        to 4 per worker so that ragged histories still balance
+
+    Output: T x N x (k + 1) coefficient array, same as rollingOLS
+    """
+    X = np.ascontiguousarray(X, dtype = np.float64)
+    Y = np.ascontiguousarray(Y, dtype = np.float64)
+    T, N = Y.shape
+    K = X.shape[1] + 1
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or N <= 1:
+        return rollingOLS(X, Y, period, min_period, chunk)
+    splits = min(N, splits or 4 * workers)
+    bounds = np.linspace(0, N, splits + 1).astype(int)
+
+    shmX, _, xSpec = _shareArray(X)
+    shmY, _, ySpec = _shareArray(Y)
+    shmC, coef, coefSpec = _shareArray(np.full((T, N, K), np.nan))
+    try:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            futures = [pool.submit(_rollingOLSWorker, xSpec, ySpec, coefSpec, start, stop, period, min_period, chunk)
+                       for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+            for future in as_completed(futures):
+                future.result()
+        return coef.copy()
+    finally:
+        del coef
+        for shm in (shmX, shmY, shmC):
+            shm.close()
+            shm.unlink()
+
+
+def coefToFrames(coef, months, factorName, assetName):
+    """
+    Wrap a T x N x (k + 1) coefficient array into a dict of DataFrame, one
+    frame per factor plus "Alpha", indexed by Month.
+    """
+    index = pd.Index(months, name = "Month")
+    regOutput = {}
+    for j, factor in enumerate(factorName):
+        regOutput[factor] = pd.DataFrame(coef[:, :, j + 1], columns = assetName, index = index)
+    regOutput["Alpha"] = pd.DataFrame(coef[:, :, 0], columns = assetName, index = index)
+    return regOutput
+
+
+class RollingFactorRegression:
+    """
+    Rolling factor regression that is advanced one month at a time.
+
+    The object keeps the cumulative sums of X'X, X'y and the observation
+    count plus the cumulative sums as they stood at each of the last `period`
+    months, so a new month is added and the oldest one dropped in
+    O(k^2 * nAsset) without looking at the history. Because the window sums
+    are the same differences of cumulative sums that rollingOLS uses, the
+    coefficients are identical to regressFactorModel on the same data.
+    """
+
+    def __init__(self, factorName, assetName, period = 36, min_period = 12):
+        """
+        :param factorName: names of the factors, in the order of the factor rows
+        :param assetName: names of the assets (industries or tickers)
+        :param period: length of the lookback window
+        :param min_period: minimum observations required in a window
+        """
+        self.factorName = list(factorName)
+        self.assetName  = list(assetName)
+        self.period     = int(period)
+        self.min_period = int(min_period)
+        N, K = len(self.assetName), len(self.factorName) + 1
+        self.nObs      = 0              # number of months seen so far
+        self.lastMonth = None
+        self.xx  = np.zeros((N, K, K))
+        self.xy  = np.zeros((N, K))
+        self.cnt = np.zeros(N)
+        # cumulative sums after each of the last `period` months, slot t % period
+        self.ringXX  = np.zeros((self.period, N, K, K))
+        self.ringXY  = np.zeros((self.period, N, K))
+        self.ringCnt = np.zeros((self.period, N))
+
+    @classmethod
+    def fromHistory(cls, factorDf: pd.DataFrame, indDf: pd.DataFrame, rfDf: pd.DataFrame, period = 36, min_period = 12):
+        """
+        Build the state from the same inputs as regressFactorModel, as if every
+        month had been passed to update().
+        """
+        months, factorName, indName, X, Y = prepareFactorData(factorDf, indDf, rfDf)
+        state = cls(factorName, indName, period, min_period)
+        T = len(months)
+        if T == 0:
+            return state
+        xx, xy, cnt = windowMoments(X, Y)
+        xx  = np.cumsum(xx, axis = 0)
+        xy  = np.cumsum(xy, axis = 0)
+        cnt = np.cumsum(cnt, axis = 0)
+        for t in range(max(T - state.period, 0), T):
+            state.ringXX[t % state.period]  = xx[t]
+            state.ringXY[t % state.period]  = xy[t]
+            state.ringCnt[t % state.period] = cnt[t]
+        state.xx, state.xy, state.cnt = xx[-1], xy[-1], cnt[-1]
+        state.nObs = T
+        state.lastMonth = months.values[-1]
+        return state
+
+    def update(self, month, factorRow, assetRow, rf = 0.):
+        """
+        Add one month and drop the oldest one from the window.
+
+        :param month: the new Month (yyyymm), must be after the last one seen
+        :param factorRow: factor returns of the month, in factorName order
+        :param assetRow: asset returns of the month, in assetName order
+        :param rf: risk free rate of the month, subtracted from assetRow
+        :return: dict of Series, one per factor plus "Alpha", the regression on
+                 the window ending at `month` (NaN until a full window is seen)
+        """
+        if self.lastMonth is not None and month <= self.lastMonth:
+            raise ValueError("month %s is not after the last month %s" % (month, self.lastMonth))
+        X = np.asarray(factorRow, dtype = np.float64).reshape(1, -1)
+        Y = np.asarray(assetRow, dtype = np.float64).reshape(1, -1) - rf
+        xx, xy, cnt = windowMoments(X, Y)
+        self.xx  = self.xx + xx[0]
+        self.xy  = self.xy + xy[0]
+        self.cnt = self.cnt + cnt[0]
+
+        t = self.nObs
+        slot = t % self.period
+        if t >= self.period:
+            coef = solveWindow(self.xx - self.ringXX[slot], self.xy - self.ringXY[slot],
+                               self.cnt - self.ringCnt[slot], self.min_period)
+        elif t == self.period - 1:
+            coef = solveWindow(self.xx, self.xy, self.cnt, self.min_period)
+        else:
+            coef = np.full(self.xy.shape, np.nan)
+        self.ringXX[slot]  = self.xx
+        self.ringXY[slot]  = self.xy
+        self.ringCnt[slot] = self.cnt
+        self.nObs = t + 1
+        self.lastMonth = month
+
+        regRow = {}
+        for j, factor in enumerate(self.factorName):
+            regRow[factor] = pd.Series(coef[:, j + 1], index = self.assetName, name = month)
+        regRow["Alpha"] = pd.Series(coef[:, 0], index = self.assetName, name = month)
+        return regRow
+
+    def save(self, path):
+        """
+        Persist the state to an .npz file.
+        """
+        np.savez(path, factorName = np.array(self.factorName, dtype = str),
+                 assetName = np.array(self.assetName, dtype = str),
+                 settings = np.array([self.period, self.min_period, self.nObs]),
+                 lastMonth = np.array([] if self.lastMonth is None else [self.lastMonth]),
+                 xx = self.xx, xy = self.xy, cnt = self.cnt,
+                 ringXX = self.ringXX, ringXY = self.ringXY, ringCnt = self.ringCnt)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Resume a state written by save().
+        """
+        with np.load(path) as f:
+            period, min_period, nObs = (int(x) for x in f["settings"])
+            state = cls(f["factorName"].tolist(), f["assetName"].tolist(), period, min_period)
+            state.nObs = nObs
+            state.lastMonth = f["lastMonth"][0].item() if len(f["lastMonth"]) else None
+            for name in ["xx", "xy", "cnt", "ringXX", "ringXY", "ringCnt"]:
+                setattr(state, name, f[name])
+        return state
@@ -5,49 +5,133 @@ Statistical Arbitrage Team Project
 @author: Fan Chen, Zhijiang Huang, Fei Li, Zhixian Lin
 """
 
-from data import (getFiveFactorData, 
-                 get5IndustryPort, 
-                 get10IndustryPort, 
-                 get49IndustryPort, 
-                 convertMonthToContinuous,
-                 getSP500Data)
+from data import (convertMonthToContinuous,
+                 getSP500Data,
+                 loadSources)
                  
-from Filter import long_short_filter, ranking_filter, long_ranking_filter
-import statsmodels.api as sm
+from Filter import long_short_filter, ranking_filter, long_ranking_filter, PANEL_FILTERS
+from factorModel import prepareFactorData, rollingOLS, parallelRollingOLS, coefToFrames
 import pandas as pd
 import numpy  as np
-import matplotlib.pyplot as plt
-from scipy import stats
 from collections import OrderedDict
 
-#function that extracts the p value for skew test 
-def Skewtest(array):
-    return stats.skewtest(array)[1]
+def skewTestPValue(skew, n):
+    """
+    Two sided p-value of stats.skewtest in array form, from the (biased) 
+    skewness and the number of observations. NaN for fewer than 8 observations.
+    """
+    from scipy import stats
+    n = np.asarray(n, dtype = np.float64)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        y = skew * np.sqrt(((n + 1) * (n + 3)) / (6.0 * (n - 2)))
+        beta2 = 3.0 * (n**2 + 27*n - 70) * (n + 1) * (n + 3) / ((n - 2.0) * (n + 5) * (n + 7) * (n + 9))
+        W2 = -1 + np.sqrt(2 * (beta2 - 1))
+        delta = 1 / np.sqrt(0.5 * np.log(W2))
+        alpha = np.sqrt(2.0 / (W2 - 1))
+        y = np.where(y == 0, 1, y)
+        Z = delta * np.log(y / alpha + np.sqrt((y / alpha)**2 + 1))
+        return np.where(n >= 8, 2 * stats.norm.sf(np.abs(Z)), np.nan)
+
+def kurtosisTestPValue(kurtosis, n):
+    """
+    Two sided p-value of stats.kurtosistest in array form, from the (biased, 
+    Fisher) kurtosis and the number of observations. NaN for fewer than 5 
+    observations.
+    """
+    from scipy import stats
+    n = np.asarray(n, dtype = np.float64)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        b2 = kurtosis + 3
+        E = 3.0 * (n - 1) / (n + 1)
+        varb2 = 24.0 * n * (n - 2) * (n - 3) / ((n + 1) * (n + 1.) * (n + 3) * (n + 5))
+        x = (b2 - E) / np.sqrt(varb2)
+        sqrtbeta1 = 6.0 * (n*n - 5*n + 2) / ((n + 7) * (n + 9)) * np.sqrt((6.0 * (n + 3) * (n + 5)) / (n * (n - 2) * (n - 3)))
+        A = 6.0 + 8.0 / sqrtbeta1 * (2.0 / sqrtbeta1 + np.sqrt(1 + 4.0 / (sqrtbeta1**2)))
+        term1 = 1 - 2 / (9.0 * A)
+        denom = 1 + x * np.sqrt(2 / (A - 4.0))
+        term2 = np.sign(denom) * np.where(denom == 0.0, np.nan, ((1 - 2.0 / A) / np.abs(denom))**(1 / 3.0))
+        Z = (term1 - term2) / np.sqrt(2 / (9.0 * A))
+        return np.where(n >= 5, 2 * stats.norm.sf(np.abs(Z)), np.nan)
 
-#function that extracts the p value for kurtosis test
-def Kurtotest(array):
-    return stats.kurtosistest(array)[1]
+def momentStatistics(n, s1, s2, s3, s4, shift = 0):
+    """
+    Descriptive statistics from the power sums of the observations.
+    
+    Input:
+        - n: number of observations
+        - s1, s2, s3, s4: sums of the observations minus shift, to the powers 
+        1 to 4. Shifting by a value near the mean keeps the central moments 
+        precise.
+        - shift: (Default: 0) the shift
+    
+    Output: OrderedDict of the statistics of descStatistics, arrays shaped 
+    like n
+    """
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        mu1, mu2, mu3, mu4 = s1 / n, s2 / n, s3 / n, s4 / n
+        m2 = np.maximum(mu2 - mu1**2, 0)
+        m3 = mu3 - 3 * mu1 * mu2 + 2 * mu1**3
+        m4 = mu4 - 4 * mu1 * mu3 + 6 * mu1**2 * mu2 - 3 * mu1**4
+        skew = np.where(m2 > 0, m3 / m2**1.5, np.nan)
+        kurto = np.where(m2 > 0, m4 / m2**2 - 3, np.nan)
+        return OrderedDict((("Mean Return", np.where(n > 0, mu1 + shift, np.nan)),
+                            ("Standard Deviation", np.where(n > 0, np.sqrt(m2), np.nan)),
+                            ("Skew", skew), ("Skew-pvalue", skewTestPValue(skew, n)),
+                            ("Kurtosis", kurto), ("Kurtosis-pvalue", kurtosisTestPValue(kurto, n))))
 
 ## Missing Descriptive statistics
-def descStatistics(indDf: pd.DataFrame, rfDf: pd.DataFrame): 
+def descStatistics(indDf: pd.DataFrame, rfDf: pd.DataFrame, window = None, min_period = None): 
+    """
+    Mean, standard deviation, skew and kurtosis (with the p-values of the 
+    skew and kurtosis tests) of the excess return of each portfolio, all from 
+    one pass of power sums over the returns. Missing returns are left out.
+    
+    Input: 
+        - indDf: DataFrame with first column Month, the other columns are the
+        return of each portfolio
+        
+        - rfDf: DataFrame with Month and RF
+        
+        - window: (Default: None) None for the full sample statistics, an int 
+        for rolling statistics over window months, from cumulative power sums
+        
+        - min_period: (Default: window) the minimum observations in a window
+    
+    Output: full sample: DataFrame with one row per portfolio and one column 
+    per statistic. Rolling: dict of DataFrame, one per statistic, indexed by 
+    Month with one column per portfolio, the row of a Month covering the 
+    window ending at that Month.
+    """
     indName=indDf.columns[1:]
     '''merge industry data with risk free data by month'''
     mergeDf=pd.merge(indDf, rfDf, on = ["Month"])
     '''excess return data'''
-    excessRet=mergeDf[indName].subtract(mergeDf['RF'], axis = 0)
-    '''compute descriptive stats'''
-    meanret=excessRet.apply(np.mean,axis=0)
-    std=excessRet.apply(np.std,axis=0)
-    skew=excessRet.apply(stats.skew,axis=0)
-    skewpvalue=excessRet.apply(Skewtest,axis=0)
-    kurto=excessRet.apply(stats.kurtosis,axis=0)
-    kurtopvalue=excessRet.apply(Kurtotest,axis=0)
-    return pd.DataFrame(OrderedDict((("Mean Return",meanret),("Standard Deviation",std),
-                         ("Skew",skew),("Skew-pvalue",skewpvalue),
-                         ("Kurtosis",kurto),("Kurtosis-pvalue",kurtopvalue))))
+    excessRet=mergeDf[indName].to_numpy(dtype = np.float64) - mergeDf[["RF"]].to_numpy(dtype = np.float64)
+    '''power sums around the portfolio means'''
+    valid = ~np.isnan(excessRet)
+    with np.errstate(invalid = "ignore"):
+        shift = np.nan_to_num(np.nanmean(np.where(valid, excessRet, np.nan), axis = 0)) if len(excessRet) else 0.
+    x = np.where(valid, excessRet - shift, 0)
+    powers = [valid.astype(np.float64), x, x**2, x**3, x**4]
+    if window is None:
+        '''compute descriptive stats'''
+        stat = momentStatistics(*[p.sum(axis = 0) for p in powers], shift = shift)
+        return pd.DataFrame(OrderedDict((name, pd.Series(value, index = indName)) for name, value in stat.items()))
+    
+    '''rolling sums from cumulative sums'''
+    min_period = window if min_period is None else min_period
+    start = np.maximum(np.arange(1, len(excessRet) + 1) - window, 0)
+    sums = []
+    for p in powers:
+        cum = np.vstack([np.zeros((1, p.shape[1])), np.cumsum(p, axis = 0)])
+        sums.append(cum[1:] - cum[start])
+    stat = momentStatistics(*sums, shift = shift)
+    enough = sums[0] >= min_period
+    return OrderedDict((name, pd.DataFrame(np.where(enough, value, np.nan), index = mergeDf["Month"], columns = indName))
+                       for name, value in stat.items())
     
 
-def regressFactorModel(factorDf: pd.DataFrame, indDf: pd.DataFrame, rfDf: pd.DataFrame, period = 36, min_period = 12):
+def regressFactorModel(factorDf: pd.DataFrame, indDf: pd.DataFrame, rfDf: pd.DataFrame, period = 36, min_period = 12, workers = 1):
     """
     Get the 
     Input: 
@@ -62,93 +146,101 @@ def regressFactorModel(factorDf: pd.DataFrame, indDf: pd.DataFrame, rfDf: pd.Dat
         
         - min_period: (Default: 12) Should be an int. The minimum observations 
         required in the regression
+        
+        - workers: (Default: 1) number of processes. Above 1 the assets are 
+        split across a process pool sharing the data in shared memory, which 
+        is worth it for stock-level panels with thousands of columns.
     
     Output: dict of DataFrame, that represents the intercept and beta to each of
-    the factors
+    the factors (one frame per factor). The row of a Month holds the regression
+    on the `period` months ending at (and including) that Month.
     
     """
     
-    assert factorDf.columns[0] == "Month"
-    assert indDf.columns[0] == "Month"
     assert type(period) == int
     assert type(min_period) == int
     
-    nFactor = len(factorDf.columns) - 1
-    nind    = len(indDf.columns) - 1
-    
-    factorName = factorDf.columns[1:]
-    indName    = indDf.columns[1:]
-    
-    # Merge Data
-    mergeDf = pd.merge(factorDf, indDf, on = ["Month"])
-    mergeDf = pd.merge(mergeDf, rfDf, on = ["Month"])
-    
-    # Get Excess return of each of the industry
-    mergeDf[indName] = mergeDf[indName].subtract(mergeDf['RF'], axis = 0)
-    mergeDf.index = mergeDf.Month
-    n = len(mergeDf)
-    regOutput = dict(zip( factorDf.columns[1:] , [pd.DataFrame(columns = indName, index = mergeDf["Month"] )] * nFactor) )
-    regOutput['Alpha'] = pd.DataFrame(columns = indName, index = mergeDf["Month"] )
-    
-    def regress(y, X): 
-        try: 
-            X = sm.add_constant(X)
-            model = sm.OLS( y, X, missing = "drop")
-            results = model.fit()
-            coefs   = results.params
-            if results.nobs < min_period:    
-                coefs = coefs * np.nan         
-        except:
-            coefs = pd.Series(data = np.nan, index = ["const"] + list(factorName))
-        return coefs
-    
-    for i in range(period, n):
-        Month = mergeDf.Month[(i - period): i]
-        curMonth = Month.values[-1]
-        for ind in indName:
-            y = mergeDf[ind][Month]
-            X = mergeDf[factorName].loc[Month]
-            temp_coef = regress(y, X)
-            regOutput["Alpha"][ind].loc[curMonth] = temp_coef.const
-            for factor in factorName:
-                regOutput[factor][ind].loc[curMonth] = temp_coef[factor]
-                            
-    return regOutput
+    months, factorName, indName, X, Y = prepareFactorData(factorDf, indDf, rfDf)
+    if workers == 1:
+        coef = rollingOLS(X, Y, period = period, min_period = min_period)
+    else:
+        coef = parallelRollingOLS(X, Y, period = period, min_period = min_period, workers = workers)
+    return coefToFrames(coef, months, factorName, indName)
 
-def validateInitStrategy(signal, portReturn, long_short = True, selection = ranking_filter):
+def portfolioValues(signal, portReturn, selections = (ranking_filter,)):
     """
-    Use the alpha signal to generate the portfolio return 
+    Value of the portfolios picked by each selection rule from the signal, 
+    rebalanced every month and held over the next month, all in matrix form:
+    the T x K positions of every month at once, times the returns of the 
+    following month, compounded with cumprod.
+    
+    Input:
+        - signal: DataFrame of the signal, indexed by continuous month (see
+        convertMonthToContinuous), one column per portfolio
+        - portReturn: DataFrame with Month and the percent return of the 
+        portfolios, in the order of the signal columns
+        - selections: list of functions that take the vector of signal and 
+        return the vector of position, e.g. ranking_filter
+    
+    Output: DataFrame indexed by the months of the signal from its first non 
+    missing month, one column of portfolio value (starting at 1) per selection
     """
-    portReturn.index = convertMonthToContinuous(portReturn.Month)
-    portReturn = portReturn.drop(["Month"], axis = 1)
+    returns = portReturn.drop(["Month"], axis = 1)
+    returns.index = convertMonthToContinuous(portReturn.Month)
     nPort = len(signal.columns)
+    assert returns.shape[1] == nPort
     
     firstMonthIdx = np.min(np.where(np.sum(pd.isnull(signal), axis = 1) < nPort - 0.01))
     firstMonth    = signal.index[firstMonthIdx]
+    signal = signal[signal.index >= firstMonth].astype(np.float64)
     
-    signal = signal[signal.index >= firstMonth]
-    signal = signal.astype(np.float64)
-    portReturn = portReturn[portReturn.index >= firstMonth]
-    
-    portValue = [1]
-    curValue  = 1
+    scores  = signal.to_numpy()[:-1]
+    forward = returns.reindex(signal.index).to_numpy(dtype = np.float64)[1:]      # return over the next month
+    values = OrderedDict()
+    for selection in selections:
+        panel = PANEL_FILTERS.get(selection)
+        if panel is not None:
+            position = panel(scores)
+        else:
+            position = np.array([selection(score) for score in scores], dtype = np.float64).reshape(scores.shape)
+        portRet = np.sum(position * forward, axis = 1)
+        values[selection.__name__] = np.r_[1., np.cumprod(1 + portRet / 100)]
+    return pd.DataFrame(values, index = signal.index)
+
+def validateInitStrategies(signals, portReturns, selections = (ranking_filter, long_ranking_filter, long_short_filter)):
+    """
+    portfolioValues for several signal / return pairs (e.g. the 5, 10 and 49 
+    industry alphas) and several selection rules in one call.
     
-    for i in range(len(signal) - 1):
-        temp_pos = selection(signal.iloc[i])
-#        print(np.sum(temp_pos))
-        temp_ret = np.dot(temp_pos , portReturn.iloc[i + 1])
-        curValue *= 1 + (temp_ret / 100)
-        portValue.append(curValue)
+    Input:
+        - signals: dict (or list) of signal frames
+        - portReturns: dict (or list) of the matching return frames
+        - selections: list of selection functions
     
-    return pd.DataFrame({"Portfolio Value":portValue}, index = signal.index)
+    Output: dict, with the keys of signals (positions for a list), of 
+    DataFrame with one column of portfolio value per selection
+    """
+    if not isinstance(signals, dict):
+        signals, portReturns = dict(enumerate(signals)), dict(enumerate(portReturns))
+    return OrderedDict((name, portfolioValues(signals[name], portReturns[name], selections)) for name in signals)
+
+def validateInitStrategy(signal, portReturn, long_short = True, selection = ranking_filter):
+    """
+    Use the alpha signal to generate the portfolio return 
+    """
+    value = portfolioValues(signal, portReturn, [selection])
+    return pd.DataFrame({"Portfolio Value": value.iloc[:, 0]}, index = value.index)
 
 if __name__ == "__main__":
-    fiveFactor = getFiveFactorData()
-    ind_5      = get5IndustryPort()
-    ind_10     = get10IndustryPort()
-    ind_49     = get49IndustryPort()
+    import matplotlib.pyplot as plt
+    
+    sources, timing = loadSources(["fiveFactor", "ind5", "ind10", "ind49"])
+    fiveFactor = sources["fiveFactor"]
+    ind_5      = sources["ind5"]
+    ind_10     = sources["ind10"]
+    ind_49     = sources["ind49"]
     
-    print("Data Successfully loaded!")
+    print("Data Successfully loaded! (%.2f s, %.2f s one after another)" % (timing["wall"], timing["sum"]))
     ind_5_factor = regressFactorModel(fiveFactor.iloc[:, 0:6], ind_5, fiveFactor[['Month', 'RF']])
     print("5 Industry Completed!")
     ind_10_factor = regressFactorModel(fiveFactor.iloc[:, 0:6], ind_10, fiveFactor[['Month', 'RF']]) 
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Statistical Arbitrage Team Project
+
+@author: Fan Chen, Zhijiang Huang, Fei Li, Zhixian Lin
+
+Month x ticker panels built from the long merged frame. Month and ticker are
+factorized once and every requested field is scattered into one
+(field, Month, ticker) array, so each field is a contiguous Month x ticker
+block and all fields share one index and one set of columns.
+"""
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from Strategy import industry_codes
+
+PANEL_META = "panel.json"
+
+
+class Panel:
+    """
+    Fields of a Month x ticker panel sharing one index and one set of columns,
+    each field a float64 Month x ticker array. Non numeric fields (e.g. 
+    Industry) are stored as category codes, NaN where missing, and decoded by
+    frame().
+    """
+
+    def __init__(self, arrays, index, columns, categories = None):
+        self.arrays     = dict(arrays)
+        self.index      = pd.Index(index)
+        self.columns    = pd.Index(columns)
+        self.categories = dict(categories or {})
+
+    @property
+    def fields(self):
+        return list(self.arrays)
+
+    def __contains__(self, field):
+        return field in self.arrays
+
+    def __getitem__(self, field):
+        return self.frame(field)
+
+    @property
+    def shape(self):
+        return (len(self.arrays), len(self.index), len(self.columns))
+
+    def array(self, field):
+        """
+        Month x ticker array of a field, no copy (category codes for non 
+        numeric fields)
+        """
+        return self.arrays[field]
+
+    def frame(self, field):
+        """
+        Month x ticker DataFrame of a field. Numeric fields share memory with
+        the panel, non numeric fields are decoded to their labels.
+        """
+        values = self.array(field)
+        if field in self.categories:
+            labels = np.asarray(self.categories[field], dtype = object)
+            valid = ~np.isnan(values)
+            decoded = np.full(values.shape, np.nan, dtype = object)
+            decoded[valid] = labels[values[valid].astype(np.intp)]
+            return pd.DataFrame(decoded, index = self.index, columns = self.columns)
+        return pd.DataFrame(values, index = self.index, columns = self.columns, copy = False)
+
+    def frames(self, fields = None):
+        """
+        dict field -> frame(field)
+        """
+        return {field: self.frame(field) for field in (self.fields if fields is None else fields)}
+
+    def industryCodes(self, ind_list, field = "Industry"):
+        """
+        Industry codes of a non numeric field as Strategy.industry_codes
+        computes them from the decoded labels, built from the stored category
+        codes without decoding.
+        """
+        values = self.array(field)
+        lookup = np.r_[industry_codes(np.asarray(self.categories[field], dtype = object), ind_list), -1]
+        return lookup[np.where(np.isnan(values), -1, values).astype(np.intp)]
+
+    def select(self, index = None, columns = None):
+        """
+        Panel of some months and / or tickers, given as boolean masks or 
+        positions (None keeps all), the arrays are copied
+        """
+        rows = slice(None) if index is None else np.asarray(index)
+        cols = slice(None) if columns is None else np.asarray(columns)
+        arrays = {field: np.ascontiguousarray(values[rows][:, cols]) for field, values in self.arrays.items()}
+        return Panel(arrays, self.index[rows], self.columns[cols], self.categories)
+
+
+def firstValid(cell, values, order):
+    """
+    For each cell, the position of its first row with a non missing value.
+
+    Input:
+        - cell: int cell number of every row
+        - values: the field, one value per row
+        - order: stable argsort of cell, shared by all the fields
+
+    Output: (cells, rows), the cells with a value and the row holding it
+    """
+    rows = order[~pd.isnull(values)[order]]
+    cells = cell[rows]
+    first = np.empty(len(rows), dtype = bool)
+    first[:1] = True
+    np.not_equal(cells[1:], cells[:-1], out = first[1:])
+    return cells[first], rows[first]
+
+
+def buildPanel(df, fields, index = "Month", columns = "ticker", universe = None):
+    """
+    Pivot several fields of a long frame in a single pass, the same values as
+    df.pivot_table(index = index, columns = columns, values = field, aggfunc = "first")
+    for each field, on a common index.
+
+    Input:
+        - df: long DataFrame with one row per (index, columns) observation
+        - fields: list of columns to pivot, any number
+        - index: (Default: "Month") column giving the panel rows
+        - columns: (Default: "ticker") column giving the panel columns
+        - universe: (Default: None, meaning all the fields) fields a ticker
+        needs at least one value of to be kept, the intersection of their
+        pivot_table columns. [] keeps every ticker.
+
+    Output: Panel, indexed by the sorted months and tickers
+    """
+    fields = list(fields)
+    universe = fields if universe is None else list(universe)
+    rowCode, months = pd.factorize(df[index], sort = True)
+    colCode, tickers = pd.factorize(df[columns], sort = True)
+    keep = (rowCode >= 0) & (colCode >= 0)
+    rowCode, colCode = rowCode[keep], colCode[keep]
+    T, N = len(months), len(tickers)
+    cell = rowCode.astype(np.int64) * N + colCode
+    order = np.argsort(cell, kind = "stable")
+
+    values = np.full((len(fields), T, N), np.nan)
+    covered = np.ones(N, dtype = bool)
+    categories = {}
+    for f, field in enumerate(fields):
+        column = df[field][keep]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            categories[field] = column.cat.categories
+            data = column.cat.codes.to_numpy().astype(np.float64)
+            data[data < 0] = np.nan
+        elif pd.api.types.is_numeric_dtype(column.dtype) or pd.api.types.is_bool_dtype(column.dtype):
+            data = column.to_numpy(dtype = np.float64, na_value = np.nan)
+        else:
+            codes, categories[field] = pd.factorize(column, sort = True)
+            data = np.where(codes >= 0, codes, np.nan)
+        cells, rows = firstValid(cell, data, order)
+        values[f].ravel()[cells] = data[rows]
+        if field in universe:
+            present = np.zeros(N, dtype = bool)
+            present[cells % N] = True
+            covered &= present
+
+    # drop tickers outside the universe and months with no value left
+    values = values[:, :, covered]
+    hasValue = ~np.isnan(values).all(axis = (0, 2))
+    values = np.ascontiguousarray(values[:, hasValue, :])
+    return Panel(dict(zip(fields, values)), months[hasValue], tickers[covered], categories)
+
+
+def broadcastIndustrySignal(signal, panel, field = "Industry"):
+    """
+    Ticker panel of an industry level signal: each cell takes the signal of 
+    the ticker's industry that month, by one gather from the Month x industry
+    matrix, without going through a long frame.
+    
+    Input:
+        - signal: Month x industry DataFrame, e.g. the Alpha or a beta of 
+        regressFactorModel, or their ranks, indexed by the months of the panel
+        - panel: Panel with the industry of each ticker
+        - field: (Default: "Industry") the industry field of the panel
+    
+    Output: Month x ticker float64 array aligned to the panel, NaN where the
+    month is not in the signal or the industry is missing or not one of the 
+    signal columns
+    """
+    nRow, nInd = signal.shape
+    codes = panel.industryCodes(signal.columns, field)
+    rows = signal.index.get_indexer(panel.index)
+    # an extra NaN row and column for the months and industries without a signal
+    padded = np.full((nRow + 1, nInd + 1), np.nan)
+    padded[:nRow, :nInd] = signal.to_numpy(dtype = np.float64)
+    return padded[rows[:, None], np.where((codes >= 0) & (codes < nInd), codes, nInd)]
+
+
+def attachIndustrySignal(panel, signal, name = "Alpha", field = "Industry", universe = True):
+    """
+    Panel with broadcastIndustrySignal(signal, panel, field) added as the 
+    field name.
+    
+    Input:
+        - universe: (Default: True) drop the tickers without any value of the
+        signal, as buildPanel does for its universe fields, and the months 
+        left with no value at all
+    """
+    arrays = dict(panel.arrays)
+    arrays[name] = broadcastIndustrySignal(signal, panel, field)
+    result = Panel(arrays, panel.index, panel.columns, panel.categories)
+    if not universe:
+        return result
+    covered = ~np.isnan(arrays[name]).all(axis = 0)
+    hasValue = np.zeros(len(panel.index), dtype = bool)
+    for values in arrays.values():
+        hasValue |= ~np.isnan(values[:, covered]).all(axis = 1)
+    return result.select(hasValue, covered)
+
+
+def savePanel(panel, directory):
+    """
+    Write a panel as one raw .npy file per field plus PANEL_META, a json file
+    with the field names, the month index, the tickers and the categories of 
+    the non numeric fields. The metadata is written last, so a directory 
+    without it is an incomplete store.
+    """
+    os.makedirs(directory, exist_ok = True)
+    for field in panel.fields:
+        np.save(os.path.join(directory, field + ".npy"), np.ascontiguousarray(panel.array(field), dtype = np.float64))
+    meta = {"fields": panel.fields,
+            "index": panel.index.tolist(),
+            "columns": panel.columns.tolist(),
+            "categories": {field: pd.Index(cats).tolist() for field, cats in panel.categories.items()}}
+    with open(os.path.join(directory, PANEL_META), "w") as f:
+        json.dump(meta, f)
+
+
+def loadPanel(directory, fields = None, mmap = True):
+    """
+    Open a panel written by savePanel.
+
+    Input:
+        - directory: the store
+        - fields: (Default: None, meaning all) fields to open
+        - mmap: (Default: True) map the .npy files read only instead of 
+        reading them. Opening is then independent of the panel size, pages are
+        read on first use and shared by every process mapping the same store.
+
+    Output: Panel whose arrays (and the frames of its numeric fields) are
+    views of the files
+    """
+    with open(os.path.join(directory, PANEL_META)) as f:
+        meta = json.load(f)
+    fields = meta["fields"] if fields is None else list(fields)
+    arrays = {field: np.load(os.path.join(directory, field + ".npy"), mmap_mode = "r" if mmap else None)
+              for field in fields}
+    categories = {field: pd.Index(cats) for field, cats in meta["categories"].items() if field in arrays}
+    return Panel(arrays, meta["index"], meta["columns"], categories)
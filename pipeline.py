@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+Statistical Arbitrage Team Project
+
+@author: Fan Chen, Zhijiang Huang, Fei Li, Zhixian Lin
+
+The pipeline of Main.py as named stages: ingest, merge, sector, factor, panel,
+alpha and backtest. The output of each stage is cached on disk under a key
+hashing the keys of the stages it depends on, the parameters it uses, the
+source of the modules of this project it runs and the data files it reads,
+so a rerun only recomputes the stages whose key changed, e.g. a new cost rate
+only reruns the backtest. The last KEEP_KEYS outputs of each stage are kept,
+so switching back to a previous setting is a cache hit.
+
+    python pipeline.py                      # run up to the backtest
+    python pipeline.py --cost 0.002         # only the backtest reruns
+    python pipeline.py --until factor --period 60 --force factor
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import inspect
+import hashlib
+import argparse
+from collections import OrderedDict
+
+import pandas as pd
+
+import Filter
+import Cost
+import data
+import factorModel
+import initValidation
+import panel as panelModule
+import Strategy
+import analytics
+from cache import getCacheDir, saveFrame, loadFrame
+from data import DATA_FILES, dataRoot, loadSources, asofMerge, cleanMergeData, mapSector, sicTablePath
+from initValidation import regressFactorModel
+from panel import Panel, buildPanel, attachIndustrySignal, savePanel, loadPanel
+from Strategy import SectorRotationStrategy
+from Cost import LinearCost
+from analytics import performanceMetrics
+
+# bump to invalidate every stage, e.g. when the storage format changes
+PIPELINE_VERSION = 2
+
+# outputs kept per stage, the most recently used ones
+KEEP_KEYS = 4
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# parameters of the pipeline and their defaults, each stage only hashes the ones it uses
+PARAMS = OrderedDict([("root", None), ("useCache", True), ("nIndustry", 10), ("period", 36),
+                      ("min_period", 12), ("forming", 6), ("holding", 1), ("ind_fltr", "long_ranking_filter"),
+                      ("stock_fltr", "equal_weight"), ("cost", 0.001), ("capital", 1000)])
+
+PANEL_FIELDS = ["prc", "bidlo", "askhi", "Industry"]
+
+STAGES = OrderedDict()      # name -> Stage, in the order they run
+
+
+class Stage:
+    """
+    A step of the pipeline: func(inputs, params) returns a dict name ->
+    DataFrame or Panel, inputs holding the outputs of the stages in deps.
+    modules are the modules it runs, their source and the source of the
+    project modules they use is part of the key, along with pipeline.py.
+    """
+    def __init__(self, name, func, deps = (), params = (), modules = (), sources = None, store = True):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.params = list(params)
+        self.modules = list(modules)
+        self.sources = sources          # function of params giving the data files read
+        self.store = store
+
+
+def stage(name, deps = (), params = (), modules = (), sources = None, store = True):
+    """
+    Register a function as a stage, see Stage.
+    """
+    def register(func):
+        STAGES[name] = Stage(name, func, deps, params, modules, sources, store)
+        return func
+    return register
+
+
+def dataFiles(*names):
+    return lambda params: [os.path.join(dataRoot(params["root"]), DATA_FILES[name]) for name in names]
+
+
+def fileIdent(path):
+    stat = os.stat(path)
+    return "%s|%d|%d" % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def projectModules(modules):
+    """
+    Source files of modules and of the project modules they use, directly or
+    not: the modules they import and the modules of the functions and classes
+    they import.
+    """
+    files, stack = set(), list(modules)
+    while stack:
+        module = stack.pop()
+        path = getattr(module, "__file__", None)
+        if not path or os.path.dirname(os.path.abspath(path)) != PROJECT_DIR or os.path.abspath(path) in files:
+            continue
+        files.add(os.path.abspath(path))
+        for value in vars(module).values():
+            name = value.__name__ if inspect.ismodule(value) else getattr(value, "__module__", None)
+            if isinstance(name, str) and name in sys.modules:
+                stack.append(sys.modules[name])
+    return sorted(files)
+
+
+def sourceVersion(paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+# the loaders cache the cleaned files themselves (see cache.cachedRead), the stage is not stored again
+@stage("ingest", modules = [data], store = False,
+       sources = dataFiles("crsp", "compustat", "sic"))
+def ingest(inputs, params):
+    sources, _ = loadSources(["crsp", "compustat", "sic"], params["root"], params["useCache"])
+    sources["sic"].date = sources["sic"].date // 100
+    return sources
+
+
+@stage("merge", deps = ["ingest"], modules = [data])
+def merge(inputs, params):
+    raw = inputs["ingest"]
+    return {"mergeDf": cleanMergeData(asofMerge(raw["crsp"], raw["compustat"], raw["sic"]))}
+
+
+@stage("sector", deps = ["merge"], params = ["nIndustry"], modules = [data],
+       sources = lambda params: [sicTablePath(params["nIndustry"])])
+def sector(inputs, params):
+    mergeDf = mapSector(inputs["merge"]["mergeDf"], params["nIndustry"])
+    return {"mergeDf": mergeDf.rename(columns = {"date": "Month"})}
+
+
+def industryChoices():
+    """
+    The industry counts whose SIC table is in industryTables (49 is not shipped)
+    """
+    choices = []
+    for nIndustry in (5, 10, 49):
+        try:
+            sicTablePath(nIndustry)
+        except FileNotFoundError:
+            continue
+        choices.append(nIndustry)
+    return choices
+
+
+def industryPort(params):
+    """
+    Source name of the industry portfolios matching the sector stage
+    """
+    if params["nIndustry"] not in (5, 10, 49):
+        raise ValueError("nIndustry is 5, 10 or 49, not %s" % params["nIndustry"])
+    return "ind%d" % params["nIndustry"]
+
+
+@stage("factor", params = ["nIndustry", "period", "min_period"],
+       modules = [data, initValidation, factorModel],
+       sources = lambda params: dataFiles("fiveFactor", industryPort(params))(params))
+def factor(inputs, params):
+    # the industries of the sector stage, so every ticker's industry has an alpha
+    sources, _ = loadSources(["fiveFactor", industryPort(params)], params["root"], params["useCache"])
+    fiveFactor = sources["fiveFactor"]
+    return regressFactorModel(fiveFactor.iloc[:, 0:6], sources[industryPort(params)], fiveFactor[["Month", "RF"]],
+                              period = params["period"], min_period = params["min_period"])
+
+
+@stage("panel", deps = ["sector"], modules = [panelModule])
+def panel(inputs, params):
+    # tickers missing any of price, bid or ask are dropped
+    return {"panel": buildPanel(inputs["sector"]["mergeDf"], PANEL_FIELDS, universe = PANEL_FIELDS[:3])}
+
+
+@stage("alpha", deps = ["panel", "factor"], modules = [panelModule])
+def alpha(inputs, params):
+    # the alpha of each ticker's industry, tickers without any are dropped
+    return {"panel": attachIndustrySignal(inputs["panel"]["panel"], inputs["factor"]["Alpha"], "Alpha")}
+
+
+@stage("backtest", deps = ["alpha", "factor"],
+       params = ["forming", "holding", "ind_fltr", "stock_fltr", "cost", "capital"],
+       modules = [Strategy, Cost, Filter, analytics])
+def backtest(inputs, params):
+    panel = inputs["alpha"]["panel"]
+    ind_list = inputs["factor"]["Alpha"].columns
+    price, bid, ask, score, industry = [panel.frame(field).reset_index(drop = True)
+                                        for field in ["prc", "bidlo", "askhi", "Alpha", "Industry"]]
+    strat = SectorRotationStrategy(price, bid, ask, score, industry, params["forming"], params["holding"],
+                                   getattr(Filter, params["ind_fltr"]), getattr(Filter, params["stock_fltr"]),
+                                   LinearCost(params["cost"]), ind_list, capital = params["capital"],
+                                   industry_codes = panel.industryCodes(ind_list))
+    strat.run()
+    result = pd.DataFrame({"value": strat.value.to_numpy(), "turnover": strat.turnover.to_numpy(),
+                           "cost_paid": strat.cost_paid.to_numpy()}, index = panel.index)
+    metrics = performanceMetrics(strat.value, strat.capital, strat.forming, strat.turnover, strat.cost_paid)
+    return {"result": result, "metrics": metrics.to_frame().T}
+
+
+def closure(target):
+    """
+    The stages target depends on, and target, in the order they run
+    """
+    needed = set()
+    def visit(name):
+        if name not in needed:
+            needed.add(name)
+            for dep in STAGES[name].deps:
+                visit(dep)
+    visit(target)
+    return [name for name in STAGES if name in needed]
+
+
+def stageKeys(names, params):
+    """
+    Cache key of each stage: a hash of the keys of its dependencies, its
+    parameters, the source of the project modules it runs (see
+    projectModules) and the files it reads
+    """
+    keys = {}
+    for name in names:
+        stg = STAGES[name]
+        ident = {"stage": name, "version": PIPELINE_VERSION,
+                 "deps": [keys[dep] for dep in stg.deps],
+                 "params": {p: params[p] for p in stg.params},
+                 "code": sourceVersion([os.path.abspath(__file__)] + projectModules(stg.modules)),
+                 "sources": [fileIdent(path) for path in stg.sources(params)] if stg.sources else []}
+        keys[name] = hashlib.sha1(json.dumps(ident, sort_keys = True, default = str).encode()).hexdigest()[:16]
+    return keys
+
+
+def stageDir(cacheDir, name, key):
+    return os.path.join(cacheDir, "%s-%s" % (name, key))
+
+
+def saveOutputs(outputs, directory):
+    """
+    Write the outputs of a stage, DataFrames with saveFrame and Panels with
+    savePanel, next to a manifest. The directory appears complete or not at all.
+    """
+    tmp = directory + ".tmp"
+    shutil.rmtree(tmp, ignore_errors = True)
+    os.makedirs(tmp)
+    manifest = OrderedDict()
+    for name, value in outputs.items():
+        if isinstance(value, Panel):
+            savePanel(value, os.path.join(tmp, name))
+            manifest[name] = "panel"
+        else:
+            saveFrame(value, os.path.join(tmp, name + ".npz"))
+            manifest[name] = "frame"
+    with open(os.path.join(tmp, "outputs.json"), "w") as f:
+        json.dump(manifest, f)
+    shutil.rmtree(directory, ignore_errors = True)
+    os.replace(tmp, directory)
+
+
+def evictOutputs(cacheDir, name, keep = KEEP_KEYS):
+    """
+    Remove the outputs of a stage but the keep most recently used ones
+    """
+    if not os.path.isdir(cacheDir):
+        return
+    dirs = [os.path.join(cacheDir, f) for f in os.listdir(cacheDir) if f.startswith(name + "-") and not f.endswith(".tmp")]
+    for directory in sorted(dirs, key = os.path.getmtime, reverse = True)[keep:]:
+        shutil.rmtree(directory, ignore_errors = True)
+
+
+def loadOutputs(directory):
+    with open(os.path.join(directory, "outputs.json")) as f:
+        manifest = json.load(f, object_pairs_hook = OrderedDict)
+    return OrderedDict((name, loadPanel(os.path.join(directory, name)) if kind == "panel"
+                        else loadFrame(os.path.join(directory, name + ".npz"))) for name, kind in manifest.items())
+
+
+def runPipeline(target = "backtest", params = None, force = (), cacheDir = None, keep = KEEP_KEYS):
+    """
+    Run the pipeline up to a stage, reusing the cached outputs whose key is
+    unchanged.
+
+    Input:
+        - target: (Default: "backtest") the last stage to run
+        - params: (Default: None) dict overriding PARAMS, useCache = False
+        neither reads nor writes any cache
+        - force: (Default: ()) stages to recompute even when cached, "all" for
+        every stage
+        - cacheDir: (Default: None, meaning <getCacheDir()>/pipeline) where
+        the stage outputs are kept
+        - keep: (Default: KEEP_KEYS) outputs kept per stage, the most recently
+        used ones
+
+    Output: (outputs, timing), outputs is a dict stage -> dict of outputs of
+    the stages that were run or loaded, timing a DataFrame with the stage,
+    status (hit, run, forced or skipped), seconds and key of each stage. A
+    cached target does not load its dependencies, they are skipped.
+    """
+    params = dict(PARAMS, **(params or {}))
+    names = closure(target)
+    force = set(names) if force == "all" or "all" in force else set(force)
+    unknown = force - set(STAGES)
+    if unknown:
+        raise ValueError("unknown stages: %s, use some of %s" % (sorted(unknown), list(STAGES)))
+    keys = stageKeys(names, params)
+    cacheDir = cacheDir or os.path.join(getCacheDir(), "pipeline")
+    outputs, timing = OrderedDict(), {}
+
+    def resolve(name):
+        if name in outputs:
+            return outputs[name]
+        stg = STAGES[name]
+        directory = stageDir(cacheDir, name, keys[name])
+        cached = stg.store and params["useCache"] and name not in force and os.path.exists(directory)
+        if cached:
+            start = time.perf_counter()
+            outputs[name] = loadOutputs(directory)
+            # marks it as recently used for evictOutputs
+            os.utime(directory)
+            status = "hit"
+        else:
+            inputs = {dep: resolve(dep) for dep in stg.deps}
+            start = time.perf_counter()
+            outputs[name] = stg.func(inputs, params)
+            if stg.store and params["useCache"]:
+                saveOutputs(outputs[name], directory)
+                evictOutputs(cacheDir, name, keep)
+            status = "forced" if name in force else "run"
+        timing[name] = (status, time.perf_counter() - start)
+        return outputs[name]
+
+    resolve(target)
+    rows = [(name,) + timing.get(name, ("skipped", 0.)) + (keys[name],) for name in names]
+    return outputs, pd.DataFrame(rows, columns = ["stage", "status", "seconds", "key"])
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Run the pipeline stages, reusing the cached ones")
+    parser.add_argument("--until", default = "backtest", choices = list(STAGES), help = "the last stage to run")
+    parser.add_argument("--force", nargs = "+", default = [], choices = list(STAGES) + ["all"],
+                        help = "stages to recompute even when cached")
+    parser.add_argument("--no-cache", action = "store_true", help = "neither read nor write any cache")
+    parser.add_argument("--cache-dir", help = "where the stage outputs are kept")
+    parser.add_argument("--keep", type = int, default = KEEP_KEYS, help = "outputs kept per stage")
+    parser.add_argument("--root", help = "data root, by default the one of data.getDropboxLoc")
+    parser.add_argument("--nIndustry", type = int, default = PARAMS["nIndustry"], choices = industryChoices(),
+                        help = "industry definitions whose industryTables/Siccodes<n>.txt is present")
+    for name in ["period", "min_period", "forming", "holding", "capital"]:
+        parser.add_argument("--" + name.replace("_", "-"), dest = name, type = int, default = PARAMS[name])
+    parser.add_argument("--ind-fltr", dest = "ind_fltr", default = PARAMS["ind_fltr"])
+    parser.add_argument("--stock-fltr", dest = "stock_fltr", default = PARAMS["stock_fltr"])
+    parser.add_argument("--cost", type = float, default = PARAMS["cost"])
+    args = parser.parse_args(argv)
+
+    params = {name: getattr(args, name) for name in PARAMS if hasattr(args, name)}
+    params["useCache"] = not args.no_cache
+    outputs, timing = runPipeline(args.until, params, args.force, args.cache_dir, args.keep)
+    print(timing.to_string(index = False, float_format = "%.3f"))
+    print("total: %.3f s" % timing.seconds.sum())
+    if "backtest" in outputs:
+        print(outputs["backtest"]["metrics"].T.to_string(header = False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
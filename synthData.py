@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Statistical Arbitrage Team Project
+
+@author: Fan Chen, Zhijiang Huang, Fei Li, Zhixian Lin
+
+Seeded synthetic data in the raw layouts the loaders of data.py read: CRSP
+monthly stock file, Compustat quarterly fundamentals, CRSP SIC codes, the
+Fama-French five factors and industry portfolios. Nothing here is real data,
+it only has the columns, types, codes and gaps of the real files, so the
+whole pipeline can be run and timed without the licensed data.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from data import DATA_FILES, loadSICTable
+
+FACTOR_NAMES = ["Mkt-RF", "SMB", "HML", "RMW", "CMA"]
+
+
+def syntheticMonths(nMonth, start = 196307):
+    """
+    nMonth consecutive months as yyyymm ints, from start
+    """
+    first = (start // 100) * 12 + start % 100 - 1
+    month = first + np.arange(nMonth)
+    return (month // 12) * 100 + month % 12 + 1
+
+
+def monthEnd(months):
+    """
+    yyyymmdd of the last day of each yyyymm month
+    """
+    days = pd.to_datetime(pd.Series(months).astype(str), format = "%Y%m") + pd.offsets.MonthEnd(0)
+    return (days.dt.year * 10000 + days.dt.month * 100 + days.dt.day).to_numpy()
+
+
+def makeSecurities(nTicker, nMonth, seed = 0):
+    """
+    The securities of the synthetic universe: identifiers, SIC code and the
+    months each one is listed.
+
+    Output: DataFrame with PERMNO, PERMCO, TICKER, CUSIP (8 characters),
+    GVKEY, SICCD, NAICS, first and last (month positions, inclusive)
+    """
+    rng = np.random.default_rng(seed)
+    # 6 character issuer code and 2 digit issue, letters included as in real CUSIPs
+    alphabet = np.array(list("0123456789ABCDEFGHJKLMNPQRSTUVWXYZ"))
+    issuer = np.unique(["".join(code) for code in alphabet[rng.integers(0, len(alphabet), (2 * nTicker + 10, 6))]])
+    cusip = np.char.add(rng.permutation(issuer)[:nTicker].astype(str), "10")
+    first = np.where(rng.random(nTicker) < 0.7, 0, rng.integers(0, nMonth, nTicker))
+    last  = np.where(rng.random(nTicker) < 0.7, nMonth - 1, rng.integers(first, nMonth))
+    return pd.DataFrame({"PERMNO": 10000 + np.arange(nTicker),
+                         "PERMCO": 50000 + np.arange(nTicker),
+                         "TICKER": ["T%05d" % k for k in range(nTicker)],
+                         "CUSIP": cusip.astype(object),
+                         "GVKEY": 1000 + np.arange(nTicker),
+                         "SICCD": rng.integers(100, 10000, nTicker),
+                         "NAICS": rng.integers(110000, 930000, nTicker).astype(np.float64),
+                         "first": first,
+                         "last": last})
+
+
+def listed(securities, nMonth):
+    """
+    (security, month) positions of the listed months, security major
+    """
+    sec, mon = np.divmod(np.arange(len(securities) * nMonth), nMonth)
+    keep = (mon >= securities["first"].to_numpy()[sec]) & (mon <= securities["last"].to_numpy()[sec])
+    return sec[keep], mon[keep]
+
+
+def makeCRSP(securities, nMonth, seed = 0):
+    """
+    CRSP monthly stock file: PERMNO, date (yyyymmdd), EXCHCD, NAICS, TICKER,
+    NCUSIP, PERMCO, CUSIP, BIDLO, ASKHI, PRC, SPREAD, ALTPRC, SHROUT, CFACPR,
+    CFACSHR. As in CRSP, a negative PRC is a bid/ask average, and some rows
+    have no NAICS code or no price.
+    """
+    rng = np.random.default_rng(seed + 1)
+    sec, mon = listed(securities, nMonth)
+    n = len(sec)
+    # log price random walk per security
+    step = rng.normal(0.005, 0.08, n)
+    startRow = np.maximum.accumulate(np.where(np.r_[True, sec[1:] != sec[:-1]], np.arange(n), 0))
+    cum = np.cumsum(step)
+    logPrice = np.log(rng.uniform(5, 100, len(securities)))[sec] + cum - cum[startRow]
+    prc = np.exp(logPrice)
+    bidlo = prc * (1 - rng.uniform(0, 0.05, n))
+    askhi = prc * (1 + rng.uniform(0, 0.05, n))
+    prc = np.where(rng.random(n) < 0.03, -prc, prc)
+    missing = rng.random(n) < 0.01
+    prc[missing] = bidlo[missing] = askhi[missing] = np.nan
+    naics = securities["NAICS"].to_numpy()[sec].copy()
+    naics[rng.random(n) < 0.02] = np.nan
+    # a few 2 for 1 splits, the cumulative factors double for the months before the split
+    split = np.log(np.where(rng.random(n) < 0.002, 2., 1.))
+    cum = np.cumsum(split)
+    after = np.bincount(sec, weights = split, minlength = len(securities))[sec] - (cum - cum[startRow] + split[startRow])
+    cfac = np.round(np.exp(after), 6)
+    months = syntheticMonths(nMonth)
+    return pd.DataFrame({"PERMNO": securities["PERMNO"].to_numpy()[sec],
+                         "date": monthEnd(months)[mon],
+                         "EXCHCD": rng.choice([1, 2, 3], n),
+                         "NAICS": naics,
+                         "TICKER": securities["TICKER"].to_numpy()[sec],
+                         "NCUSIP": securities["CUSIP"].to_numpy()[sec],
+                         "PERMCO": securities["PERMCO"].to_numpy()[sec],
+                         "CUSIP": securities["CUSIP"].to_numpy()[sec],
+                         "BIDLO": bidlo,
+                         "ASKHI": askhi,
+                         "PRC": prc,
+                         "SPREAD": np.nan,
+                         "ALTPRC": np.abs(prc),
+                         "SHROUT": rng.uniform(1000, 500000, len(securities))[sec].round(),
+                         "CFACPR": cfac,
+                         "CFACSHR": cfac})
+
+
+def makeCompustat(securities, nMonth, seed = 0):
+    """
+    Compustat quarterly fundamentals, one filing per listed quarter end: gvkey,
+    datadate (yyyymmdd), fyearq, fqtr, indfmt, consol, popsrc, datafmt, tic,
+    cusip (9 characters, with the check digit), curcdq, datacqtr, datafqtr,
+    atq, cshprq, epspxq, exchg, costat, naics, mkvaltq. Some filings are
+    missing.
+    """
+    rng = np.random.default_rng(seed + 2)
+    sec, mon = listed(securities, nMonth)
+    months = syntheticMonths(nMonth)
+    quarterEnd = months[mon] % 100 % 3 == 0
+    sec, mon = sec[quarterEnd], mon[quarterEnd]
+    keep = rng.random(len(sec)) < 0.95
+    sec, mon = sec[keep], mon[keep]
+    n = len(sec)
+    year, month = months[mon] // 100, months[mon] % 100
+    quarter = (month - 1) // 3 + 1
+    label = np.char.add(np.char.add(year.astype(str), "Q"), quarter.astype(str))
+    check = rng.integers(0, 10, len(securities)).astype(str)
+    return pd.DataFrame({"gvkey": securities["GVKEY"].to_numpy()[sec],
+                         "datadate": monthEnd(months)[mon],
+                         "fyearq": year,
+                         "fqtr": quarter,
+                         "indfmt": "INDL",
+                         "consol": "C",
+                         "popsrc": "D",
+                         "datafmt": "STD",
+                         "tic": securities["TICKER"].to_numpy()[sec],
+                         "cusip": np.char.add(securities["CUSIP"].to_numpy().astype(str), check)[sec],
+                         "curcdq": "USD",
+                         "datacqtr": label,
+                         "datafqtr": label,
+                         "atq": rng.lognormal(6, 1.5, n),
+                         "cshprq": rng.lognormal(3, 1, n),
+                         "epspxq": rng.normal(0.5, 1, n),
+                         "exchg": rng.choice([11, 12, 14], n),
+                         "costat": "A",
+                         "naics": np.where(rng.random(n) < 0.02, np.nan, securities["NAICS"].to_numpy()[sec]),
+                         "mkvaltq": rng.lognormal(7, 1.5, n)})
+
+
+def makeSIC(securities, nMonth, seed = 0):
+    """
+    CRSP SIC codes: PERMNO, date (yyyymmdd), SICCD, CUSIP, one row per listed
+    month. As in CRSP, a few SICCD are "Z" (unknown).
+    """
+    rng = np.random.default_rng(seed + 3)
+    sec, mon = listed(securities, nMonth)
+    sic = securities["SICCD"].to_numpy()[sec].astype(str).astype(object)
+    sic[rng.random(len(sec)) < 0.01] = "Z"
+    return pd.DataFrame({"PERMNO": securities["PERMNO"].to_numpy()[sec],
+                         "date": monthEnd(syntheticMonths(nMonth))[mon],
+                         "SICCD": sic,
+                         "CUSIP": securities["CUSIP"].to_numpy()[sec]})
+
+
+def makeFiveFactor(nMonth, seed = 0):
+    """
+    Fama-French five factors, monthly percent returns: Month (yyyymm), Mkt-RF,
+    SMB, HML, RMW, CMA, RF
+    """
+    rng = np.random.default_rng(seed + 4)
+    df = pd.DataFrame(rng.normal([0.6, 0.2, 0.3, 0.25, 0.3], [4.5, 3, 3, 2.2, 2], (nMonth, 5)).round(2),
+                      columns = FACTOR_NAMES)
+    df.insert(0, "Month", syntheticMonths(nMonth))
+    df["RF"] = rng.uniform(0, 0.6, nMonth).round(2)
+    return df
+
+
+def makeIndustryPort(nMonth, nIndustry = 10, seed = 0):
+    """
+    Fama-French industry portfolios, monthly percent returns: Month (yyyymm)
+    and one column per industry of the Siccodes definition, with the -99.99
+    missing value code in a few places.
+    """
+    industries = loadSICTable(nIndustry)[3]
+    rng = np.random.default_rng(seed + 5)
+    beta = rng.uniform(0.6, 1.4, len(industries))
+    market = rng.normal(0.8, 4.5, nMonth)
+    returns = (market[:, None] * beta + rng.normal(0, 2.5, (nMonth, len(industries)))).round(2)
+    returns[rng.random(returns.shape) < 0.005] = -99.99
+    df = pd.DataFrame(returns, columns = list(industries))
+    df.insert(0, "Month", syntheticMonths(nMonth))
+    return df
+
+
+def writeDataRoot(root, nTicker, nMonth, seed = 0):
+    """
+    Write a synthetic data root, the raw files at the DATA_FILES paths, for
+    the loaders of data.py (path = root or STAT_ARB_DATA = root).
+
+    Input:
+        - root: directory to write to
+        - nTicker: number of securities
+        - nMonth: number of months, from July 1963 like the French data
+        - seed: (Default: 0) the same seed writes the same files
+
+    Output: root
+    """
+    securities = makeSecurities(nTicker, nMonth, seed)
+    frames = {"crsp": makeCRSP(securities, nMonth, seed),
+              "compustat": makeCompustat(securities, nMonth, seed),
+              "sic": makeSIC(securities, nMonth, seed),
+              "fiveFactor": makeFiveFactor(nMonth, seed),
+              "ind5": makeIndustryPort(nMonth, 5, seed),
+              "ind10": makeIndustryPort(nMonth, 10, seed)}
+    for name, df in frames.items():
+        path = os.path.join(root, DATA_FILES[name])
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        df.to_csv(path, index = False)
+    return root